@@ -0,0 +1,366 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+import pyqtgraph as pg
+from PyQt5.QtCore import QSettings, QTimer
+from PyQt5.QtWidgets import QApplication
+
+from main import MainData, MainWindow
+from sender_udp import generate_frames
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# метрики, по которым сравниваются прогоны: имя и направление "лучше"
+TRACKED = {
+    'decode_packets_per_s': 'higher',
+    'add_batch_packets_per_s': 'higher',
+    'received_packets_per_s': 'higher',
+    'drop_rate': 'lower',
+    'latency_ms_p95': 'lower',
+    'render_ms_p95': 'lower',
+}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # в Linux ru_maxrss в килобайтах, в macOS в байтах
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def percentiles(values, prefix):
+    values = np.asarray(values, dtype=float)
+    if not len(values):
+        return {f'{prefix}_{name}': None for name in ('mean', 'p50', 'p95', 'max')}
+    return {
+        f'{prefix}_mean': float(values.mean()),
+        f'{prefix}_p50': float(np.percentile(values, 50)),
+        f'{prefix}_p95': float(np.percentile(values, 95)),
+        f'{prefix}_max': float(values.max()),
+    }
+
+
+def bench_decode(packets, repeat):
+    frames = generate_frames(packets, 10_000)
+    data = MainData()
+    decode_times = []
+    add_times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        batch = MainData.decode(frames)
+        decoded = time.perf_counter()
+        data.add_batch(batch)
+        decode_times.append(decoded - started)
+        add_times.append(time.perf_counter() - decoded)
+    return {
+        'packets': packets,
+        'decode_packets_per_s': packets / min(decode_times),
+        'add_batch_packets_per_s': packets / min(add_times),
+    }
+
+
+class PipelineProbe:
+    # оборачивает методы конкретных объектов, сам код приложения не меняется
+    def __init__(self, window):
+        self.window = window
+        self.arrivals = {}
+        self.latencies = []
+        self.stages = {'decode': [], 'update_data': [], 'render': [], 'frame': []}
+        self.batch_sizes = []
+
+    def attach_thread(self, thread):
+        take_batches = thread.take_batches
+        if not hasattr(thread, 'decode'):
+            # декодер в отдельном процессе: пачка отмечается при чтении из общей памяти
+            def tracked_shared_batches():
+                for batch in take_batches():
+                    self.batch_sizes.append(len(batch['time_src']))
+                    self.pending.append(thread.last_update)
+                    yield batch
+
+            thread.take_batches = tracked_shared_batches
+            return
+        decode = thread.decode
+
+        def timed_decode():
+            count = len(thread.arena)
+            started = time.perf_counter()
+            decode()
+            if count:
+                self.stages['decode'].append(time.perf_counter() - started)
+                self.batch_sizes.append(count)
+                self.arrivals[id(thread.batches[-1])] = thread.last_update
+
+        def tracked_batches():
+            for batch in take_batches():
+                self.pending.append(self.arrivals.pop(id(batch), None))
+                yield batch
+
+        thread.decode = timed_decode
+        thread.take_batches = tracked_batches
+
+    def attach_window(self):
+        window = self.window
+        update_data = window.update_data
+        update_all_graphics = window.update_all_graphics
+        render_frame = window.render_scheduler.render_frame
+        self.pending = []
+
+        def timed_update_data():
+            started = time.perf_counter()
+            updated = update_data()
+            if updated:
+                self.stages['update_data'].append(time.perf_counter() - started)
+            return updated
+
+        def timed_update_all_graphics(*args, **kwargs):
+            started = time.perf_counter()
+            update_all_graphics(*args, **kwargs)
+            self.stages['render'].append(time.perf_counter() - started)
+            # задержка считается от конца чтения пачки до перерисовки кривых
+            now = time.time_ns()
+            self.latencies.extend(
+                (now - arrival) / 1e6 for arrival in self.pending if arrival)
+            self.pending.clear()
+
+        def timed_render_frame():
+            started = time.perf_counter()
+            render_frame()
+            self.stages['frame'].append(time.perf_counter() - started)
+
+        window.update_data = timed_update_data
+        window.update_all_graphics = timed_update_all_graphics
+        # таймер уже подключён к старому методу, поэтому соединение переназначается
+        timer = window.render_scheduler.timer
+        timer.timeout.disconnect()
+        timer.timeout.connect(timed_render_frame)
+
+    def summary(self):
+        result = {}
+        for stage, values in self.stages.items():
+            result.update(percentiles(np.asarray(values) * 1000, f'{stage}_ms'))
+        result.update(percentiles(self.latencies, 'latency_ms'))
+        result['batches'] = len(self.batch_sizes)
+        result['batch_size_mean'] = float(np.mean(self.batch_sizes)) \
+            if self.batch_sizes else None
+        result['frames'] = len(self.stages['frame'])
+        return result
+
+
+def run_sender(args, port, count):
+    return subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(__file__), 'sender_udp.py'),
+         '--host', 'localhost', '--port', str(port), '--rate', str(args.rate),
+         '--count', str(count), '--burst', str(args.burst),
+         '--frames', str(min(count, 65_536))],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+
+def sent_packets(output, count):
+    # последняя строка отчёта отправителя: "отправлено: N, пропущено: M, ..."
+    for line in reversed(output.splitlines()):
+        if 'отправлено:' in line:
+            return int(line.split('отправлено:')[1].split(',')[0])
+    return count
+
+
+def create_window(app, args, directory):
+    # своя settings.ini во временном каталоге: настройки пользователя
+    # не влияют на прогон и не меняются им
+    settings = QSettings(os.path.join(directory, 'settings.ini'), QSettings.IniFormat)
+    settings.setValue('sources', [str(args.port)])
+    settings.setValue('decoder', args.decoder)
+    settings.setValue('receiver', args.receiver)
+    settings.sync()
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        return MainWindow(app)
+    finally:
+        os.chdir(cwd)
+
+
+def bench_pipeline(app, args, graphs, resolution):
+    with tempfile.TemporaryDirectory() as directory:
+        return run_pipeline(app, args, graphs, resolution, directory)
+
+
+def run_pipeline(app, args, graphs, resolution, directory):
+    window = create_window(app, args, directory)
+    names = list(MainData.channels)
+    for graph in range(graphs):
+        start = graph * args.curves % len(names)
+        window.create_graph_window(tuple(names[start:start + args.curves]))
+    if args.vid:
+        window.create_vid_graph()
+    window.slider_resolution.setValue(resolution)
+    window.resolution = resolution
+
+    probe = PipelineProbe(window)
+    probe.attach_window()
+    window.start_process()
+    probe.attach_thread(window.acquisition_thread)
+
+    count = int(args.rate * args.duration)
+    port = window.sources[0].port
+    # сокет приёмника должен успеть открыться до первого пакета; дочернему
+    # процессу декодера нужно ещё импортировать numpy и main
+    delay = 2.0 if args.decoder == 'process' else 0.2
+    sender = []
+    QTimer.singleShot(int(delay * 1000),
+                      lambda: sender.append(run_sender(args, port, count)))
+    started = time.perf_counter()
+    QTimer.singleShot(int((delay + args.duration + args.settle) * 1000), app.quit)
+    app.exec()
+    elapsed = time.perf_counter() - started - delay
+
+    received = window.acquisition_thread.received_packets
+    output, _ = sender[0].communicate()
+    sent = sent_packets(output, count)
+    window.stop_process()
+    window.close()
+    window.deleteLater()
+    app.processEvents()
+
+    result = {
+        'graphs': graphs,
+        'curves': graphs * args.curves,
+        'resolution': resolution,
+        'receiver': args.receiver,
+        'decoder': args.decoder,
+        'rate': args.rate,
+        'sent': sent,
+        'received': received,
+        'drop_rate': 1 - received / sent if sent else None,
+        'received_packets_per_s': received / max(elapsed - args.settle, 1e-9),
+    }
+    result.update(probe.summary())
+    return result
+
+
+def run_key(run):
+    # в старых результатах декодер не записывался, тогда он был в потоке
+    return (run['graphs'], run['resolution'], run['receiver'],
+            run.get('decoder', 'thread'))
+
+
+def compare(results, baseline, tolerance):
+    baseline_runs = {run_key(run): run for run in baseline.get('pipeline', [])}
+    regressions = []
+    pairs = [(results['decode'], baseline.get('decode', {}), 'decode')]
+    pairs += [
+        (run, baseline_runs[run_key(run)],
+         f"graphs={run['graphs']} resolution={run['resolution']}")
+        for run in results['pipeline']
+        if run_key(run) in baseline_runs
+    ]
+    for current, previous, label in pairs:
+        for metric, better in TRACKED.items():
+            new, old = current.get(metric), previous.get(metric)
+            if new is None or old is None or old == 0:
+                continue
+            change = (new - old) / abs(old)
+            if better == 'higher' and change < -tolerance \
+                    or better == 'lower' and change > tolerance:
+                regressions.append({
+                    'run': label, 'metric': metric, 'baseline': old,
+                    'current': new, 'change': change})
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Нагрузочный тест цепочки приём -> декодирование -> отрисовка')
+    parser.add_argument('--graphs', type=int, nargs='+', default=[1, 4, 9])
+    parser.add_argument('--resolutions', type=int, nargs='+',
+                        default=[1000, 10000, 50000])
+    parser.add_argument('--curves', type=int, default=3,
+                        help='кривых на одном графике')
+    parser.add_argument('--vid', action='store_true',
+                        help='добавить график видеосигнала')
+    parser.add_argument('--receiver', choices=['qt', 'socket'], default='qt')
+    parser.add_argument('--decoder', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--port', type=int, default=2015,
+                        help='порт приёмника на время прогона')
+    parser.add_argument('--rate', type=float, default=20_000,
+                        help='скорость отправителя, пакетов/с')
+    parser.add_argument('--burst', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=3.0,
+                        help='длительность одного прогона, с')
+    parser.add_argument('--settle', type=float, default=0.5,
+                        help='ожидание после окончания отправки, с')
+    parser.add_argument('--decode-packets', type=int, default=65_536)
+    parser.add_argument('--decode-repeat', type=int, default=10)
+    parser.add_argument('--skip-pipeline', action='store_true')
+    parser.add_argument('--output', help='файл для результатов в JSON')
+    parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='допустимое ухудшение метрики, доля')
+    args = parser.parse_args()
+
+    results = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pyqtgraph': pg.__version__,
+        'args': vars(args),
+        'decode': bench_decode(args.decode_packets, args.decode_repeat),
+        'pipeline': [],
+    }
+
+    if not args.skip_pipeline:
+        app = QApplication(sys.argv)
+        for graphs in args.graphs:
+            for resolution in args.resolutions:
+                run = bench_pipeline(app, args, graphs, resolution)
+                results['pipeline'].append(run)
+                print(f"graphs={graphs} resolution={resolution}: "
+                      f"{run['received_packets_per_s']:.0f} пакетов/с, "
+                      f"потери {run['drop_rate']:.2%}, "
+                      f"задержка p95 {run['latency_ms_p95'] or 0:.1f} мс",
+                      file=sys.stderr)
+    # пик памяти общий для всего процесса, поэтому один на все прогоны
+    results['peak_rss_mb'] = peak_rss_mb()
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            results['regressions'] = compare(results, json.load(f), args.tolerance)
+        exit_code = 1 if results['regressions'] else 0
+
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
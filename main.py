@@ -1,21 +1,575 @@
+import ast
+import bisect
+import gzip
+import json
+import multiprocessing
 import os
-import pickle
+import select
+import socket
+import queue
+import struct
 import sys
+import threading
 import time
-from functools import partial
-from itertools import count, cycle
+from collections import deque
+from functools import partial, reduce
+from itertools import cycle
+from multiprocessing import shared_memory
 
 import numpy as np
 import pyqtgraph as pg
-from PyQt5.QtCore import (QSettings, QSharedMemory, QSystemSemaphore, Qt,
-                          QThread, QTimer, pyqtSignal)
+from PyQt5.QtCore import (QRectF, QSettings, QSharedMemory, QSystemSemaphore,
+                          Qt, QThread, QTimer)
 from PyQt5.QtGui import QColor, QIcon, QPalette, QPixmap
 from PyQt5.QtNetwork import QUdpSocket, QHostAddress
-from PyQt5.QtWidgets import (QAction, QApplication, QComboBox, QFileDialog,
-                             QHBoxLayout, QInputDialog, QLabel, QMainWindow,
-                             QMenu, QMessageBox, QPushButton, QSlider,
-                             QToolBar, QTreeWidget, QTreeWidgetItem,
-                             QVBoxLayout, QWidget)
+from PyQt5.QtWidgets import (QAction, QApplication, QComboBox, QDockWidget,
+                             QFileDialog, QHBoxLayout, QInputDialog, QLabel,
+                             QMainWindow, QMenu, QMessageBox, QPushButton,
+                             QSlider, QTableWidget, QTableWidgetItem, QToolBar,
+                             QTreeWidget, QTreeWidgetItem, QVBoxLayout,
+                             QWidget)
+
+
+class RingBuffer:
+    def __init__(self, capacity, dtype, shape=()):
+        self.capacity = capacity
+        # каждый отсчёт пишется дважды (i и i + capacity), поэтому последние
+        # size отсчётов всегда лежат в памяти непрерывно и отдаются без копии
+        self.buffer = np.zeros((2 * capacity, *shape), dtype=dtype)
+        self.head = 0
+        self.size = 0
+        self.total = 0
+
+    def __len__(self):
+        return self.size
+
+    def clear(self, total=0):
+        self.head = 0
+        self.size = 0
+        self.total = total
+
+    def extend(self, data):
+        data = np.asarray(data)
+        count = len(data)
+        if not count:
+            return
+        self.total += count
+        if count > self.capacity:
+            data = data[-self.capacity:]
+            count = self.capacity
+
+        capacity = self.capacity
+        start = self.head
+        end = start + count
+        if end <= capacity:
+            self.buffer[start:end] = data
+            self.buffer[start + capacity:end + capacity] = data
+        else:
+            first = capacity - start
+            self.buffer[start:capacity] = data[:first]
+            self.buffer[start + capacity:] = data[:first]
+            self.buffer[:count - first] = data[first:]
+            self.buffer[capacity:capacity + count - first] = data[first:]
+        self.head = end % capacity
+        self.size = min(self.size + count, capacity)
+
+    def last(self, count=None):
+        if count is None or count > self.size:
+            count = self.size
+        end = self.head + self.capacity
+        return self.buffer[end - count:end]
+
+    def get_range(self, start, stop):
+        first = self.total - self.size
+        start = min(max(start, first), self.total)
+        stop = min(max(stop, start), self.total)
+        return self.last()[start - first:stop - first]
+
+
+class EnvelopeLevel:
+    def __init__(self, block, factor, capacity, dtype, shape):
+        self.block = block
+        self.factor = factor
+        self.mins = RingBuffer(capacity, dtype, shape)
+        self.maxs = RingBuffer(capacity, dtype, shape)
+        self.tail_min = np.empty((factor, *shape), dtype=dtype)
+        self.tail_max = np.empty((factor, *shape), dtype=dtype)
+        self.tail = 0
+
+    def clear(self, total=0):
+        self.mins.clear(total)
+        self.maxs.clear(total)
+        self.tail = 0
+
+    def extend(self, mins, maxs):
+        if self.tail:
+            mins = np.concatenate((self.tail_min[:self.tail], mins))
+            maxs = np.concatenate((self.tail_max[:self.tail], maxs))
+        complete = len(mins) // self.factor * self.factor
+        self.tail = len(mins) - complete
+        self.tail_min[:self.tail] = mins[complete:]
+        self.tail_max[:self.tail] = maxs[complete:]
+        if not complete:
+            return None
+        shape = (complete // self.factor, self.factor, *mins.shape[1:])
+        mins = mins[:complete].reshape(shape).min(axis=1)
+        maxs = maxs[:complete].reshape(shape).max(axis=1)
+        self.mins.extend(mins)
+        self.maxs.extend(maxs)
+        return mins, maxs
+
+
+class EnvelopePyramid:
+    def __init__(self, capacity, dtype, shape=(), factor=8, min_blocks=64):
+        self.levels = []
+        block = factor
+        while capacity // block >= min_blocks:
+            self.levels.append(EnvelopeLevel(
+                block, factor, capacity // block + 1, dtype, shape))
+            block *= factor
+
+    def clear(self, total=0):
+        # total должен быть кратен блоку верхнего уровня, иначе блоки сместятся
+        for level in self.levels:
+            level.clear(total // level.block)
+
+    def extend(self, data):
+        # каждый уровень сворачивает по factor блоков предыдущего в min/max
+        mins = maxs = np.asarray(data)
+        for level in self.levels:
+            result = level.extend(mins, maxs)
+            if result is None:
+                break
+            mins, maxs = result
+
+    def select(self, span, pixels):
+        selected = None
+        for level in self.levels:
+            if span < level.block * pixels:
+                break
+            selected = level
+        return selected
+
+    def get_extrema(self, buffer, start, stop, index=None):
+        # середина отрезка берётся из крупного уровня, края - из более мелких
+        if index is None:
+            index = len(self.levels) - 1
+        if start >= stop:
+            return []
+        if index < 0:
+            data = buffer.get_range(start, stop)
+            return [(data.min(axis=0), data.max(axis=0))] if len(data) else []
+        level = self.levels[index]
+        first = max(-(-start // level.block),
+                    level.mins.total - len(level.mins))
+        last = min(stop // level.block, level.mins.total)
+        if first >= last:
+            return self.get_extrema(buffer, start, stop, index - 1)
+        return [
+            (level.mins.get_range(first, last).min(axis=0),
+             level.maxs.get_range(first, last).max(axis=0)),
+            *self.get_extrema(buffer, start, first * level.block, index - 1),
+            *self.get_extrema(buffer, last * level.block, stop, index - 1),
+        ]
+
+
+class PrefixSums:
+    def __init__(self, capacity, dtype, shape=(), block=8):
+        self.block = block
+        # для целых каналов суммы точные, без накопления ошибки округления
+        self.dtype = np.int64 if np.issubdtype(dtype, np.integer) else np.float64
+        self.shape = shape
+        self.sums = RingBuffer(capacity // block + 2, self.dtype, shape)
+        self.squares = RingBuffer(capacity // block + 2, self.dtype, shape)
+        self.clear()
+
+    def clear(self, total=0):
+        # total должен быть кратен block
+        self.origin = total // self.block
+        self.sums.clear(self.origin)
+        self.squares.clear(self.origin)
+        self.tail = 0
+        self.count = 0
+        self.total_sum = np.zeros(self.shape, self.dtype)
+        self.total_squares = np.zeros(self.shape, self.dtype)
+        self.mins = None
+        self.maxs = None
+        self.last = None
+
+    def extend(self, data):
+        if not len(data):
+            return
+        values = np.asarray(data, dtype=self.dtype)
+        sums = np.cumsum(self.split_blocks(values), axis=0)
+        squares = np.cumsum(self.split_blocks(values * values), axis=0)
+        bounds = (self.tail + len(values)) // self.block
+        self.sums.extend(self.total_sum + sums[:bounds])
+        self.squares.extend(self.total_squares + squares[:bounds])
+        self.total_sum = self.total_sum + sums[-1]
+        self.total_squares = self.total_squares + squares[-1]
+        self.tail = (self.tail + len(values)) % self.block
+
+        mins, maxs = data.min(axis=0), data.max(axis=0)
+        self.mins = mins if self.mins is None else np.minimum(self.mins, mins)
+        self.maxs = maxs if self.maxs is None else np.maximum(self.maxs, maxs)
+        self.count += len(values)
+        self.last = data[-1].copy()
+
+    def split_blocks(self, values):
+        # суммы по кускам между границами блоков: дополнение прошлого блока,
+        # целые блоки и начало следующего
+        head = min((self.block - self.tail) % self.block, len(values))
+        middle = head + (len(values) - head) // self.block * self.block
+        parts = [
+            values[head:middle].reshape(-1, self.block, *self.shape).sum(axis=1)]
+        if head:
+            parts.insert(0, values[:head].sum(axis=0, keepdims=True))
+        if middle < len(values):
+            parts.append(values[middle:].sum(axis=0, keepdims=True))
+        return np.concatenate(parts)
+
+    def get_prefix(self, block):
+        if block == self.origin:
+            return 0, 0
+        return (self.sums.get_range(block - 1, block)[0],
+                self.squares.get_range(block - 1, block)[0])
+
+    def get_sums(self, buffer, start, stop):
+        first = -(-start // self.block)
+        last = stop // self.block
+        if first >= last or first - 1 < self.sums.total - len(self.sums) \
+                and first != self.origin:
+            edges = [(start, stop)]
+            sums = squares = 0
+        else:
+            # O(1): разность префиксных сумм плюс неполные блоки по краям
+            edges = [(start, first * self.block), (last * self.block, stop)]
+            (sums, squares), (base_sums, base_squares) = \
+                self.get_prefix(last), self.get_prefix(first)
+            sums, squares = sums - base_sums, squares - base_squares
+        for edge_start, edge_stop in edges:
+            values = buffer.get_range(edge_start, edge_stop).astype(self.dtype)
+            sums = sums + values.sum(axis=0)
+            squares = squares + (values * values).sum(axis=0)
+        return sums, squares
+
+
+class TransitionLog:
+    def __init__(self, capacity):
+        # фронты битовых каналов: номер отсчёта, колонка и новое значение
+        self.samples = RingBuffer(capacity, np.int64)
+        self.columns = RingBuffer(capacity, np.int16)
+        self.values = RingBuffer(capacity, np.uint8)
+        self.clear()
+
+    def clear(self):
+        self.samples.clear()
+        self.columns.clear()
+        self.values.clear()
+        self.last = None
+
+    def extend(self, data, start):
+        if not len(data):
+            return
+        rows = data if self.last is None else np.concatenate((self.last[None], data))
+        row, column = np.nonzero(rows[1:] != rows[:-1])
+        self.samples.extend(start + len(data) - len(rows) + 1 + row)
+        self.columns.extend(column)
+        self.values.extend(rows[1:][row, column])
+        self.last = data[-1].copy()
+
+    def first(self):
+        # после вытеснения старых фронтов полная история есть только с первого
+        # сохранённого отсчёта
+        if self.samples.total == len(self.samples):
+            return None
+        return self.samples.get_range(
+            self.samples.total - len(self.samples),
+            self.samples.total - len(self.samples) + 1)[0]
+
+    def get_range(self, start, stop):
+        # фронты строго после start: состояние в start берётся из самих данных
+        samples = self.samples.last()
+        first = np.searchsorted(samples, start, 'right')
+        last = np.searchsorted(samples, stop, 'left')
+        return (samples[first:last], self.columns.last()[first:last],
+                self.values.last()[first:last])
+
+
+def summarize(count, sums, squares, mins, maxs, last):
+    mean = np.asarray(sums, dtype=np.float64) / count
+    mean_square = np.asarray(squares, dtype=np.float64) / count
+    return {
+        'count': count,
+        'min': mins,
+        'max': maxs,
+        'mean': mean,
+        'std': np.sqrt(np.maximum(mean_square - mean * mean, 0)),
+        'rms': np.sqrt(mean_square),
+        'last': last,
+    }
+
+
+class PacketArena:
+    def __init__(self, slots, packet_size):
+        self.slots = slots
+        self.packet_size = packet_size
+        self.memory = bytearray(slots * packet_size)
+        self.view = memoryview(self.memory)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def is_full(self):
+        return self.count >= self.slots
+
+    def write(self, data):
+        size = min(len(data), self.packet_size)
+        offset = self.count * self.packet_size
+        self.view[offset:offset + size] = data[:size]
+        if size < self.packet_size:
+            self.view[offset + size:offset + self.packet_size] = bytes(
+                self.packet_size - size)
+        self.count += 1
+
+    def write_frames(self, frames):
+        offset = self.count * self.packet_size
+        data = np.ascontiguousarray(frames).view(np.uint8).reshape(-1)
+        self.view[offset:offset + len(data)] = data
+        self.count += len(frames)
+
+    def receive(self, sock):
+        offset = self.count * self.packet_size
+        size = sock.recv_into(
+            self.view[offset:offset + self.packet_size], self.packet_size)
+        if size < self.packet_size:
+            self.view[offset + size:offset + self.packet_size] = bytes(
+                self.packet_size - size)
+        self.count += 1
+
+    def frames(self, dtype):
+        return np.frombuffer(self.memory, dtype=dtype, count=self.count)
+
+    def reset(self):
+        self.count = 0
+
+
+class DecodePlan:
+    def __init__(self, categories):
+        main = categories['main']
+        self.main_dtype = main['dtype']
+        self.coef = np.array(main['coef'], dtype=self.main_dtype)
+        self.unsigned = np.array([
+            index for index, type in enumerate(main['types'])
+            if np.dtype(type).kind == 'u'
+        ], dtype=np.intp)
+        # беззнаковые колонки читаются как int16, отрицательные сдвигаются на 2**16
+        self.wrap = self.coef[self.unsigned] * 65536
+        self.arinc_dtype = categories['arinc']['dtype']
+
+    def decode(self, res):
+        block = res['data_main']
+        data_main = np.multiply(block, self.coef, dtype=self.main_dtype)
+        if len(self.unsigned):
+            data_main[:, self.unsigned] += (
+                block[:, self.unsigned] < 0) * self.wrap
+        return {
+            'data_main': data_main,
+            'time_src': res['time_src'][:, 0] * 0.02,
+            'arinc_data': res['arinc_data'].astype(self.arinc_dtype),
+            'bit_data': np.unpackbits(res['bit_data'], axis=1, bitorder='little'),
+            'vid_data': res['vid_data'].copy(),
+        }
+
+
+class MovingAverage:
+    # хвост окна хранится между пачками, поэтому его длина ограничена
+    max_window = 65_536
+
+    def __init__(self, window):
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.tail = np.zeros(0)
+
+    def __call__(self, values):
+        # хвост прошлой пачки дополняет окно, история заново не пересчитывается
+        data = np.concatenate((self.tail, values))
+        sums = np.concatenate(([0.0], np.cumsum(data)))
+        stop = np.arange(len(self.tail), len(data)) + 1
+        start = np.maximum(stop - self.window, 0)
+        self.tail = data[len(data) - min(self.window - 1, len(data)):]
+        return (sums[stop] - sums[start]) / (stop - start)
+
+
+class Difference:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.last = None
+
+    def __call__(self, values):
+        if not len(values):
+            return values
+        previous = values[0] if self.last is None else self.last
+        self.last = values[-1]
+        return np.diff(values, prepend=previous)
+
+
+class CumulativeSum:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.total = 0.0
+
+    def __call__(self, values):
+        result = self.total + np.cumsum(values, dtype=np.float64)
+        if len(result):
+            self.total = result[-1]
+        return result
+
+
+class DerivedChannel:
+    operators = {
+        ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply,
+        ast.Div: np.divide, ast.Pow: np.power, ast.Mod: np.mod,
+        ast.FloorDiv: np.floor_divide,
+        # над флагами bit_data &, | и ^ понимаются как логические операции
+        ast.BitAnd: np.logical_and, ast.BitOr: np.logical_or,
+        ast.BitXor: np.logical_xor,
+    }
+    comparisons = {
+        ast.Lt: np.less, ast.LtE: np.less_equal, ast.Gt: np.greater,
+        ast.GtE: np.greater_equal, ast.Eq: np.equal, ast.NotEq: np.not_equal,
+    }
+    # функция и точное число аргументов: лишний аргумент ufunc стал бы её out
+    functions = {
+        'abs': (np.abs, 1), 'sqrt': (np.sqrt, 1), 'log': (np.log, 1),
+        'exp': (np.exp, 1), 'sin': (np.sin, 1), 'cos': (np.cos, 1),
+        'min': (np.minimum, 2), 'max': (np.maximum, 2),
+        'where': (np.where, 3), 'clip': (np.clip, 3),
+    }
+    # функции с состоянием между пачками и число их постоянных параметров
+    stateful = {
+        'mean': (MovingAverage, 1), 'diff': (Difference, 0),
+        'cumsum': (CumulativeSum, 0),
+    }
+
+    def __init__(self, name, expression, channels):
+        self.name = name
+        self.expression = expression
+        self.names = []
+        self.states = []
+        self.count = 0
+        # текст ошибки, если канал отключён после сбоя вычисления
+        self.error = None
+        try:
+            tree = ast.parse(expression, mode='eval')
+        except SyntaxError:
+            raise ValueError(f'Ошибка в выражении: {expression}')
+        self.root = self.compile(tree.body, channels)
+
+        # пробное вычисление ловит ошибки формы и типов до приёма данных
+        try:
+            self.evaluate({name: np.zeros(2) for name in self.names}, 2)
+        except Exception as error:
+            raise ValueError(f'Ошибка вычисления выражения {expression}: {error}')
+        finally:
+            self.reset()
+
+    def compile(self, node, channels):
+        if isinstance(node, ast.Name):
+            if node.id not in channels or node.id == 'vid_data':
+                raise ValueError(f'Неизвестный канал: {node.id}')
+            if node.id not in self.names:
+                self.names.append(node.id)
+            return lambda env: env[node.id]
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return lambda env: node.value
+        if isinstance(node, ast.BinOp) and type(node.op) in self.operators:
+            operator = self.operators[type(node.op)]
+            left = self.compile(node.left, channels)
+            right = self.compile(node.right, channels)
+            return lambda env: operator(left(env), right(env))
+        if isinstance(node, ast.UnaryOp):
+            operand = self.compile(node.operand, channels)
+            if isinstance(node.op, ast.USub):
+                return lambda env: np.negative(operand(env))
+            if isinstance(node.op, ast.UAdd):
+                return operand
+            return lambda env: np.logical_not(operand(env))
+        if isinstance(node, ast.BoolOp):
+            operator = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            values = [self.compile(value, channels) for value in node.values]
+            # попарно, чтобы массивы и константы свободно сочетались
+            return lambda env: reduce(operator, [value(env) for value in values])
+        if isinstance(node, ast.Compare):
+            if any(type(op) not in self.comparisons for op in node.ops):
+                raise ValueError(f'Неподдерживаемое сравнение: {ast.unparse(node)}')
+            items = [self.compile(item, channels) for item in [node.left, *node.comparators]]
+            operators = [self.comparisons[type(op)] for op in node.ops]
+            return lambda env: reduce(np.logical_and, [
+                operator(items[i](env), items[i + 1](env))
+                for i, operator in enumerate(operators)
+            ])
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+                and not node.keywords:
+            name = node.func.id
+            if name in self.functions:
+                function, count = self.functions[name]
+                if len(node.args) != count:
+                    raise ValueError(
+                        f'Функция {name} принимает аргументов: {count}')
+                args = [self.compile(arg, channels) for arg in node.args]
+                return lambda env: function(*(arg(env) for arg in args))
+            if name == 'peak' and len(node.args) == 1 \
+                    and isinstance(node.args[0], ast.Name):
+                # пик по отсчётам пакета, единственный способ использовать vid_data
+                source = node.args[0].id
+                if source not in channels:
+                    raise ValueError(f'Неизвестный канал: {source}')
+                if source not in self.names:
+                    self.names.append(source)
+                return lambda env: np.reshape(env[source], (self.count, -1)).max(axis=1)
+            if name in self.stateful:
+                state_class, count = self.stateful[name]
+                constants = [
+                    arg.value for arg in node.args[1:]
+                    if isinstance(arg, ast.Constant) and type(arg.value) is int
+                ]
+                if len(node.args) != count + 1 or len(constants) != count:
+                    raise ValueError(f'Неверные аргументы функции {name}')
+                if name == 'mean' and not 1 <= constants[0] <= MovingAverage.max_window:
+                    raise ValueError(
+                        f'Окно mean должно быть от 1 до {MovingAverage.max_window}')
+                state = state_class(*constants)
+                self.states.append(state)
+                argument = self.compile(node.args[0], channels)
+                return lambda env: state(np.broadcast_to(
+                    np.asarray(argument(env), np.float64), (self.count, )))
+        raise ValueError(f'Недопустимая конструкция в выражении: {ast.unparse(node)}')
+
+    def reset(self):
+        for state in self.states:
+            state.reset()
+
+    def get_env(self, batch, channels, env=None):
+        env = {} if env is None else env
+        for name in self.names:
+            if name not in env:
+                field, column = channels[name]
+                env[name] = batch[field] if column is None else batch[field][:, column]
+        return env
+
+    def evaluate(self, env, count):
+        self.count = count
+        with np.errstate(all='ignore'):
+            result = self.root(env)
+        return np.broadcast_to(np.asarray(result, np.float64), (count, ))
 
 
 class MainData:
@@ -65,12 +619,17 @@ class MainData:
                 np.int16, np.int16, np.int16, np.int16, np.int16,
                 np.int16, np.uint16
             ],
+            'field': 'data_main',
+            'dtype': np.float32,
             'visible': True
         },
         'vid_data': {
             'headers': [
                 'vid_data'
             ],
+            'field': 'vid_data',
+            'dtype': np.uint8,
+            'shape': (1024, ),
             'visible': False
         },
         'arinc': {
@@ -79,6 +638,8 @@ class MainData:
                 'ARINC_085', 'ARINC_086', 'ARINC_087', 'ARINC_088',
                 'ARINC_089'
             ],
+            'field': 'arinc_data',
+            'dtype': np.uint16,
             'visible': True
         },
         'bit_data': {
@@ -94,12 +655,16 @@ class MainData:
                 'kontrol_27V_m_pit', 'kontrol_27V_m', 'kontrol_27V_p_pit', 'kontrol_27V_p',
                 'kontrol_27V_p_A0', 'kontrol_27V_p_A1', 'kontrol_27V_p_A2', 'kontrol_27V_p_A3'
             ],
+            'field': 'bit_data',
+            'dtype': np.uint8,
             'visible': True
         },
         'time_src': {
             'headers': [
                 'time_src'
             ],
+            'field': 'time_src',
+            'dtype': np.float64,
             'visible': True
         }
     }
@@ -132,6 +697,11 @@ class MainData:
             'kontrol_27V_m_pit', 'kontrol_27V_m', 'kontrol_27V_p_pit', 'kontrol_27V_p', 'kontrol_27V_p_A0', 'kontrol_27V_p_A1', 'kontrol_27V_p_A2', 'kontrol_27V_p_A3'
         ]
     ]
+    channels = {
+        name: (category['field'], index if len(category['headers']) > 1 else None)
+        for category in categories.values()
+        for index, name in enumerate(category['headers'])
+    }
 
     dt = np.dtype([
         ('pack_header', np.uint8, (1, )),
@@ -146,97 +716,1620 @@ class MainData:
         ('null_bytes4', np.uint8, 33)
     ]).newbyteorder('>')
 
-    def __init__(self):
+    plan = DecodePlan(categories)
+    # time_src считается тактами по 20 мкс, после умножения на 0.02 - миллисекунды
+    time_scale = 0.001
+
+    def __init__(self, capacity=51_000, vid_capacity=4_096, edge_capacity=262_144):
+        self.capacity = capacity
+        self.vid_capacity = vid_capacity
+        self.edge_capacity = edge_capacity
+        # одна колонка на поле пакета: каналы категории хранятся матрицей (n, k)
+        self.buffers = {}
         for category in self.categories.values():
-            for name in category['headers']:
-                setattr(self, name, [])
-        self.counter = count()
+            headers = category['headers']
+            size = vid_capacity if category['field'] == 'vid_data' else capacity
+            shape = category.get(
+                'shape', (len(headers), ) if len(headers) > 1 else ())
+            self.buffers[category['field']] = RingBuffer(
+                size, category['dtype'], shape)
+        self.pyramids = {
+            field: EnvelopePyramid(capacity, buffer.buffer.dtype,
+                                   buffer.buffer.shape[1:])
+            for field, buffer in self.buffers.items()
+            if field in ('data_main', 'arinc_data', 'bit_data')
+        }
+        self.prefix = {
+            field: PrefixSums(capacity, self.buffers[field].buffer.dtype,
+                              self.buffers[field].buffer.shape[1:])
+            for field in self.pyramids
+        }
+        # абсолютные номера отсчётов, перед которыми обнаружен разрыв по time_src
+        self.gaps = RingBuffer(4_096, np.int64)
+        # фронты bit_data копятся при добавлении пачки, логический анализатор
+        # рисует их, не перебирая отсчёты
+        self.transitions = TransitionLog(edge_capacity)
+        # производные каналы добавляются к копии общего словаря каналов
+        self.channels = dict(MainData.channels)
+        self.derived = {}
+        # отключённые при вычислении производные каналы: (имя, текст ошибки)
+        self.errors = deque()
+        self.generation = 0
+        self.source = None
+        self.source_offset = 0
 
     def __iter__(self):
         for category in self.categories.values():
             for name in category['headers']:
                 yield name
+        yield from self.derived
 
     def clear_data(self):
-        self.__init__()
-
-    def add_data(self, name, data):
-        value = getattr(self, name)
-        value.extend(data)
-
-    def cut_data(self):
-        for category in self.categories.values():
-            for name in category['headers']:
-                value = getattr(self, name)
-                del value[:-51_000]
-
-    def get_object(self, name):
-        return getattr(self, name)
+        for buffer in self.buffers.values():
+            buffer.clear()
+        for pyramid in self.pyramids.values():
+            pyramid.clear()
+        for prefix in self.prefix.values():
+            prefix.clear()
+        self.transitions.clear()
+        for channel in self.derived.values():
+            channel.reset()
+        self.gaps.clear()
+        self.generation += 1
+
+    def add_derived(self, name, expression):
+        if name in self.channels:
+            raise ValueError(f'Канал {name} уже существует')
+        channel = DerivedChannel(name, expression, self.channels)
+        field = f'derived.{name}'
+        buffer = RingBuffer(self.capacity, np.float64)
+        pyramid = EnvelopePyramid(self.capacity, np.float64)
+        prefix = PrefixSums(self.capacity, np.float64)
+
+        # история считается один раз при создании, начиная с границы блока пирамиды
+        sources = [self.buffers['time_src']] + [
+            self.buffers[self.channels[source][0]] for source in channel.names]
+        block = pyramid.levels[-1].block if pyramid.levels else 1
+        first = max(source.total - len(source) for source in sources)
+        start = -(-first // block) * block
+        stop = sources[0].total
+        values = None
+        if stop > start:
+            env = {
+                source: self.get_points(source, None, start, stop)[1]
+                for source in channel.names
+            }
+            try:
+                values = channel.evaluate(env, stop - start)
+            except Exception as error:
+                raise ValueError(f'Ошибка вычисления канала {name}: {error}')
+
+        buffer.clear(start)
+        pyramid.clear(start)
+        prefix.clear(start)
+        self.buffers[field] = buffer
+        self.pyramids[field] = pyramid
+        self.prefix[field] = prefix
+        self.channels[name] = (field, None)
+        self.derived[name] = channel
+        if values is not None:
+            self.add_data(field, values)
+        self.generation += 1
+
+    def remove_derived(self, name):
+        for channel in self.derived.values():
+            if name in channel.names:
+                raise ValueError(f'Канал {name} используется в канале {channel.name}')
+        field, _ = self.channels.pop(name)
+        del self.derived[name]
+        del self.buffers[field]
+        del self.pyramids[field]
+        del self.prefix[field]
+        self.generation += 1
+
+    def add_data(self, field, data):
+        if field == 'bit_data':
+            self.transitions.extend(data, self.buffers[field].total)
+        self.buffers[field].extend(data)
+        if field in self.pyramids:
+            self.pyramids[field].extend(data)
+            self.prefix[field].extend(data)
+
+    def get_stats(self, field, start, stop):
+        # статистика всех колонок поля на отрезке отсчётов [start, stop)
+        buffer = self.buffers[field]
+        start = max(start, buffer.total - len(buffer))
+        stop = min(stop, buffer.total)
+        if stop <= start:
+            return None
+        extrema = self.pyramids[field].get_extrema(buffer, start, stop)
+        return summarize(
+            stop - start, *self.prefix[field].get_sums(buffer, start, stop),
+            np.min([mins for mins, _ in extrema], axis=0),
+            np.max([maxs for _, maxs in extrema], axis=0),
+            buffer.get_range(stop - 1, stop)[0])
+
+    def get_session_stats(self, field):
+        prefix = self.prefix[field]
+        if not prefix.count:
+            return None
+        return summarize(prefix.count, prefix.total_sum, prefix.total_squares,
+                         prefix.mins, prefix.maxs, prefix.last)
+
+    def get_transitions(self, start, stop):
+        buffer = self.buffers['bit_data']
+        first = self.transitions.first()
+        start = max(start, buffer.total - len(buffer), first or 0)
+        stop = min(stop, buffer.total)
+        if stop <= start:
+            return None
+        state = buffer.get_range(start, start + 1)[0]
+        return (start, stop, state, *self.transitions.get_range(start, stop))
+
+    def get_channel_stats(self, count=None):
+        # count=None - вся сессия, иначе последние count отсчётов
+        fields = {}
+        for field in self.prefix:
+            if count is None:
+                fields[field] = self.get_session_stats(field)
+            else:
+                fields[field] = self.get_stats(
+                    field, *self.get_window(self.channels_of(field)[0], count))
+        result = {}
+        for field, stats in fields.items():
+            if stats is None:
+                continue
+            for name in self.channels_of(field):
+                column = self.channels[name][1]
+                result[name] = {
+                    key: value if column is None or np.ndim(value) == 0
+                    else value[column]
+                    for key, value in stats.items()
+                }
+        return result
 
-    def get_time(self, index):
-        time_src = getattr(self, 'time_src')
-        if not len(time_src):
+    def channels_of(self, field):
+        return [name for name, (channel_field, _) in self.channels.items()
+                if channel_field == field]
+
+    def get_object(self, name, count=None):
+        field, column = self.channels[name]
+        data = self.buffers[field].last(count)
+        return data if column is None else data[:, column]
+
+    def get_window(self, name, count):
+        buffer = self.buffers[self.channels[name][0]]
+        return buffer.total - min(count, len(buffer)), buffer.total
+
+    def get_level(self, name, span, pixels):
+        pyramid = self.pyramids.get(self.channels[name][0])
+        return pyramid.select(span, pixels) if pyramid else None
+
+    def get_points(self, name, level, start, stop):
+        field, column = self.channels[name]
+        if level is None:
+            buffer = self.buffers[field]
+            start = max(start, buffer.total - len(buffer))
+            oy = buffer.get_range(start, stop)
+            ox = np.arange(start, start + len(oy))
+            return ox, oy if column is None else oy[:, column]
+
+        start = max(start, level.mins.total - len(level.mins))
+        mins = level.mins.get_range(start, stop)
+        maxs = level.maxs.get_range(start, stop)
+        if column is not None:
+            mins, maxs = mins[:, column], maxs[:, column]
+        ox = np.repeat((np.arange(start, start + len(mins)) + 0.5) * level.block, 2)
+        oy = np.empty(len(ox))
+        oy[0::2] = mins
+        oy[1::2] = maxs
+        return ox, oy
+
+    def get_times(self, samples):
+        # время отсчётов в секундах; отсчёты вне окна прижимаются к его краям
+        buffer = self.buffers['time_src']
+        times = buffer.last()
+        if not len(times):
+            return np.zeros(len(samples))
+        index = np.clip(np.asarray(samples).astype(np.int64)
+                        - (buffer.total - len(buffer)), 0, len(times) - 1)
+        return times[index] * self.time_scale
+
+    def find_sample(self, time_value):
+        buffer = self.buffers['time_src']
+        return buffer.total - len(buffer) + int(np.searchsorted(
+            buffer.last(), time_value / self.time_scale))
+
+    def get_time(self, sample):
+        buffer = self.buffers['time_src']
+        first = buffer.total - len(buffer)
+        if first <= sample < buffer.total:
+            return buffer.get_range(sample, sample + 1)[0]
+        if self.source is not None:
+            return self.source.get_time(self.get_packet(sample))
+        if not len(buffer):
             return None
-        if index < 0:
-            return time_src[0]
-        if index >= len(time_src):
-            return time_src[-1]
-        return time_src[index]
+        sample = min(max(sample, first), buffer.total - 1)
+        return buffer.get_range(sample, sample + 1)[0]
 
     def add_byte_data(self, data):
         res = np.frombuffer(data, dtype=self.dt, count=-1)
         self.unpack_data(res)
 
     def unpack_data(self, res):
-        main_headers = self.categories['main']['headers']
-        main_coef = self.categories['main']['coef']
-        main_types = self.categories['main']['types']
+        self.add_batch(self.decode(res))
+
+    def add_batch(self, batch):
+        # производные каналы считаются до записи, чтобы буферы не разошлись
+        derived = self.evaluate_derived(batch) if self.derived else {}
+        gaps = batch.get('gaps')
+        if gaps is not None and len(gaps):
+            self.gaps.extend(self.buffers['time_src'].total + gaps)
+        filled = batch.get('filled')
+        if filled is not None and len(filled):
+            # пропуск закрыт опоздавшим пакетом, его метка больше не нужна
+            positions = self.gaps.last()
+            kept = positions[~np.isin(positions, self.buffers['time_src'].total + filled)]
+            self.gaps.clear(self.gaps.total - len(positions))
+            self.gaps.extend(kept)
+        for field, value in batch.items():
+            if field in self.buffers:
+                self.add_data(field, value)
+        for field, value in derived.items():
+            self.add_data(field, value)
+
+    def evaluate_derived(self, batch):
+        count = len(batch['time_src'])
+        env = {}
+        result = {}
+        for channel in self.derived.values():
+            values = None
+            if channel.error is None:
+                try:
+                    values = channel.evaluate(
+                        channel.get_env(batch, self.channels, env), count)
+                except Exception as error:
+                    # канал отключается, а его буфер дальше заполняется NaN
+                    channel.error = str(error)
+                    self.errors.append((channel.name, channel.error))
+            if values is None:
+                values = np.full(count, np.nan)
+            env[channel.name] = values
+            result[self.channels[channel.name][0]] = values
+        return result
 
-        for index, (name, coef, type) in enumerate(zip(main_headers, main_coef, main_types)):
-            self.add_data(name, res['data_main'][:, index].astype(type) * coef)
+    def get_memory(self):
+        memory = {}
+        for name, (field, column) in self.channels.items():
+            buffer = self.buffers[field]
+            size = buffer.buffer.nbytes
+            pyramid = self.pyramids.get(field)
+            if pyramid is not None:
+                size += sum(level.mins.buffer.nbytes + level.maxs.buffer.nbytes
+                            for level in pyramid.levels)
+                prefix = self.prefix[field]
+                size += prefix.sums.buffer.nbytes + prefix.squares.buffer.nbytes
+            if field == 'bit_data':
+                transitions = self.transitions
+                size += sum(buffer.buffer.nbytes for buffer in (
+                    transitions.samples, transitions.columns, transitions.values))
+            memory[name] = size // (1 if column is None else buffer.buffer.shape[1])
+        return memory
+
+    def get_gaps(self, start, stop):
+        gaps = self.gaps.last()
+        return gaps[(gaps >= start) & (gaps < stop)]
+
+    def load_frames(self, frames, header=1, chunk=65_536):
+        monitor = SequenceMonitor(header)
+        for start in range(max(0, len(frames) - self.capacity), len(frames), chunk):
+            res = frames[start:start + chunk]
+            batch = self.decode(res)
+            report = monitor.check(res)
+            batch['gaps'] = report['offsets']
+            batch['filled'] = report['filled']
+            self.add_batch(batch)
+
+    def load_source(self, index, stop, header=1):
+        stop = min(max(stop, 0), len(index))
+        start = max(0, stop - self.capacity)
+        self.clear_data()
+        self.source = index
+        self.source_offset = start
+        self.load_frames(index.frames[start:stop], header)
+
+    def close_source(self):
+        if self.source is not None:
+            self.source = None
+            self.source_offset = 0
+            self.clear_data()
+
+    def get_packet(self, sample):
+        return self.source_offset + sample
+
+    @classmethod
+    def decode(cls, res):
+        return cls.plan.decode(res)
+
+
+class RecordWriter:
+    magic = b'VIDGRAPH'
+    version = 1
+    header_size = 4096
+
+    def __init__(self, file_name, dtype, compress=False):
+        self.file_name = file_name
+        if compress:
+            self.file = gzip.open(file_name, 'wb', compresslevel=1)
+        else:
+            self.file = open(file_name, 'wb', buffering=8 * 1024 * 1024)
+        self.file.write(self.make_header(dtype))
+        self.packet_size = dtype.itemsize
+        self.size = 0
+        self.started = time.monotonic()
+        self.sequence = {
+            'packets': 0, 'missing': 0, 'recovered': 0, 'lost': 0, 'duplicates': 0,
+            'reordered': 0, 'invalid': 0, 'gaps': []
+        }
 
-        self.add_data('time_src', res['time_src'][:, 0] * 0.02)
+    @classmethod
+    def make_header(cls, dtype):
+        description = json.dumps({
+            'version': cls.version,
+            'packet_size': dtype.itemsize,
+            'dtype': dtype.descr,
+            'created': time.time(),
+        }).encode()
+        header = cls.magic + struct.pack('<II', cls.version, cls.header_size)
+        header += description
+        if len(header) > cls.header_size:
+            raise ValueError('Описание формата не помещается в заголовок')
+        return header.ljust(cls.header_size, b' ')
+
+    def write(self, data, report=None):
+        packet = self.size // self.packet_size
+        self.file.write(data)
+        self.size += len(data)
+        self.sequence['packets'] += len(data) // self.packet_size
+        if report is None:
+            return
+        for key in ('duplicates', 'reordered', 'recovered', 'invalid'):
+            self.sequence[key] += report[key]
+        self.sequence['missing'] += int(report['missing'].sum())
+        self.sequence['lost'] = self.sequence['missing'] - self.sequence['recovered']
+        # разрыв: номер пакета в сегменте, time_src после разрыва, число пропущенных
+        self.sequence['gaps'].extend(
+            [packet + int(offset), int(time_src), int(missing)]
+            for offset, time_src, missing in zip(
+                report['offsets'], report['times'], report['missing']))
+        if len(report['filled']):
+            filled = set((packet + report['filled']).tolist())
+            self.sequence['gaps'] = [
+                gap for gap in self.sequence['gaps'] if gap[0] not in filled]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            with open(self.sequence_name(self.file_name), 'w') as f:
+                json.dump(self.sequence, f)
 
-        for index, col in enumerate(self.categories['arinc']['headers']):
-            self.add_data(col, res['arinc_data'][:, index])
+    @staticmethod
+    def sequence_name(file_name):
+        return file_name + '.seq.json'
+
+
+class RecordReader:
+    def __init__(self, file_name):
+        self.file_name = file_name
+        with open(file_name, 'rb') as f:
+            compressed = f.read(2) == b'\x1f\x8b'
+        opener = gzip.open if compressed else open
+        with opener(file_name, 'rb') as f:
+            header_size = self.read_header(f)
+            if compressed:
+                content = f.read()
+
+        if compressed:
+            # сжатую запись нельзя отобразить в память, она распаковывается целиком
+            self.frames = np.frombuffer(
+                content, dtype=self.dtype,
+                count=len(content) // self.dtype.itemsize)
+            return
+        count = (os.path.getsize(file_name) - header_size) // self.dtype.itemsize
+        # пакеты не читаются в память: страницы файла подгружаются по мере обращения
+        if count:
+            self.frames = np.memmap(file_name, dtype=self.dtype, mode='r',
+                                    offset=header_size, shape=(count, ))
+        else:
+            self.frames = np.zeros(0, dtype=self.dtype)
+
+    def read_header(self, f):
+        prefix = f.read(len(RecordWriter.magic) + 8)
+        if len(prefix) < len(RecordWriter.magic) + 8 or \
+                not prefix.startswith(RecordWriter.magic):
+            raise ValueError(f'{self.file_name} не является файлом записи')
+        version, header_size = struct.unpack(
+            '<II', prefix[len(RecordWriter.magic):])
+        if version > RecordWriter.version:
+            raise ValueError(f'Неподдерживаемая версия записи: {version}')
+
+        self.header = json.loads(f.read(header_size - len(prefix)))
+        self.dtype = np.dtype([
+            (field[0], field[1], *(tuple(shape) for shape in field[2:]))
+            for field in self.header['dtype']
+        ])
+        return header_size
+
+    def __len__(self):
+        return len(self.frames)
+
+
+class RecordIndex:
+    def __init__(self, frames, step=1024):
+        self.frames = frames
+        self.step = step
+        # разреженный индекс: время каждого step-го пакета
+        self.times = frames['time_src'][::step, 0] * 0.02
+
+    def __len__(self):
+        return len(self.frames)
+
+    def get_time(self, packet):
+        if not len(self.frames):
+            return None
+        packet = min(max(packet, 0), len(self.frames) - 1)
+        return self.frames['time_src'][packet, 0] * 0.02
 
-        for i, val in enumerate(self.columns_bits):
-            bit_data = self.unpack_bits(val, res['bit_data'][:, i])
-            for key, value in bit_data.items():
-                self.add_data(key, np.array(value))
+    def find(self, time_value):
+        block = max(int(np.searchsorted(self.times, time_value, side='right')) - 1, 0)
+        start = block * self.step
+        times = self.frames['time_src'][start:start + self.step, 0] * 0.02
+        return start + int(np.searchsorted(times, time_value))
 
-        self.add_data('vid_data', res['vid_data'])
 
-        counter = next(self.counter)
-        if counter > 20_000:
-            self.cut_data()
-            self.counter = count()
+class RecorderThread(QThread):
+    def __init__(self, file_name, dtype, max_size=1024 * 1024 * 1024,
+                 max_time=3600, compress=False, max_backlog=512 * 1024 * 1024,
+                 rotate=True):
+        super().__init__()
+        self.file_name = file_name
+        self.dtype = dtype
+        self.max_size = max_size
+        self.max_time = max_time
+        self.compress = compress
+        self.max_backlog = max_backlog
+        # без ротации всё пишется в один файл с именем file_name
+        self.rotate = rotate
+        self.queue = queue.SimpleQueue()
+        # каждый счётчик меняет только один поток: queued - приём, written - запись
+        self.queued_bytes = 0
+        self.written_bytes = 0
+        self.dropped_packets = 0
+        self.files = []
+        self.error = None
+        # после finish или ошибки запись не принимается; блокировка не даёт
+        # потоку приёма положить пачку позади метки конца
+        self.lock = threading.Lock()
+        self.finished = False
+
+    def write(self, data, report=None):
+        with self.lock:
+            if self.finished or self.error is not None:
+                return
+            if self.queued_bytes - self.written_bytes > self.max_backlog:
+                self.dropped_packets += len(data) // self.dtype.itemsize
+                return
+            self.queued_bytes += len(data)
+            self.queue.put((bytes(data), report))
+
+    def finish(self):
+        # запись дописывается в фоне, без ожидания
+        with self.lock:
+            if self.finished:
+                return
+            self.finished = True
+            self.queue.put(None)
+
+    def stop(self):
+        self.finish()
+        self.wait()
+
+    def segment_name(self, index):
+        root, ext = os.path.splitext(self.file_name)
+        file_name = f'{root}_{index:04d}{ext or ".vgr"}' if self.rotate else \
+            f'{root}{ext or ".vgr"}'
+        return file_name + '.gz' if self.compress else file_name
+
+    def is_segment_full(self, writer):
+        if not self.rotate:
+            return False
+        return writer.size >= self.max_size or \
+            time.monotonic() - writer.started >= self.max_time
 
-    @staticmethod
-    def unpack_bits(columns, data):
-        result = {
-            name: ((data & (1 << i)) >> i) for i, name in enumerate(columns)}
+    def run(self):
+        writer = None
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                chunk, report = item
+                if writer is None or self.is_segment_full(writer):
+                    if writer is not None:
+                        writer.close()
+                    writer = RecordWriter(
+                        self.segment_name(len(self.files)), self.dtype,
+                        self.compress)
+                    self.files.append(writer.file_name)
+                writer.write(chunk, report)
+                self.written_bytes += len(chunk)
+        except OSError as e:
+            with self.lock:
+                self.error = str(e)
+            # недописанные пачки больше не нужны, память освобождается сразу
+            while not self.queue.empty():
+                self.queue.get()
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+class TriggerEngine:
+    modes = {'Фронт': 'rising', 'Спад': 'falling', 'Уровень': 'level',
+             'Изменение': 'change'}
+
+    def __init__(self, expression, mode='rising', pre=1_000, post=1_000,
+                 holdoff=0, directory='triggers', dtype=MainData.dt):
+        # условие - то же выражение, что и у производных каналов, по пакетам пачки
+        self.condition = DerivedChannel('trigger', expression, MainData.channels)
+        self.expression = expression
+        self.mode = mode
+        self.pre = pre
+        self.post = max(post, 1)
+        self.holdoff = holdoff
+        self.directory = directory
+        self.dtype = dtype
+        self.history = RingBuffer(max(pre, 1), np.uint8, (dtype.itemsize, ))
+        self.previous = None
+        self.packets = 0
+        self.next_packet = 0
+        self.triggered = 0
+        self.captures = []
+        self.closing = []
+        self.events = deque()
+        # process идёт в потоке приёма, а stop вызывается из окна
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.error = None
+
+    def process(self, batch, raw):
+        with self.lock:
+            if self.stopped or self.error is not None or not len(raw):
+                return
+            try:
+                self.process_batch(batch, raw)
+            except Exception as error:
+                # триггер снимается, а приём данных продолжается
+                self.error = str(error)
+                self.close_captures(force=True)
+
+    def process_batch(self, batch, raw):
+        count = len(raw)
+        values = self.condition.evaluate(
+            self.condition.get_env(batch, MainData.channels), count)
+        previous = np.concatenate((
+            values[:1] if self.previous is None else [self.previous], values[:-1]))
+        self.previous = values[-1]
+        if self.mode == 'level':
+            hits = values != 0
+        elif self.mode == 'rising':
+            hits = (values != 0) & (previous == 0)
+        elif self.mode == 'falling':
+            hits = (values == 0) & (previous != 0)
+        else:
+            hits = values != previous
+
+        for capture in self.captures:
+            self.write_capture(capture, raw[:capture['remaining']])
+        # после срабатывания следующее ищется не раньше конца записи и паузы holdoff
+        positions = np.flatnonzero(hits)
+        index = np.searchsorted(positions, self.next_packet - self.packets)
+        while index < len(positions):
+            position = int(positions[index])
+            self.start_capture(batch, raw, position)
+            self.next_packet = self.packets + position + self.post + self.holdoff
+            index = np.searchsorted(positions, self.next_packet - self.packets)
+
+        self.history.extend(raw[-self.pre:] if self.pre else raw[:0])
+        self.packets += count
+        self.close_captures()
+
+    def start_capture(self, batch, raw, position):
+        os.makedirs(self.directory, exist_ok=True)
+        recorder = RecorderThread(
+            os.path.join(self.directory, time.strftime(
+                f'trigger_%Y%m%d_%H%M%S_{self.triggered:04d}.vgr')), self.dtype,
+            rotate=False)
+        recorder.start()
+        self.triggered += 1
+        if self.pre:
+            history = np.concatenate((self.history.last(), raw[:position]))[-self.pre:]
+            recorder.write(history.reshape(-1))
+        capture = {
+            'recorder': recorder,
+            'remaining': self.post,
+            'packet': self.packets + position,
+            'time': float(batch['time_src'][position]) * MainData.time_scale,
+            'pre': min(self.pre, len(self.history) + position),
+        }
+        self.write_capture(capture, raw[position:position + self.post])
+        self.captures.append(capture)
+
+    def write_capture(self, capture, raw):
+        if len(raw):
+            capture['recorder'].write(raw.reshape(-1))
+            capture['remaining'] -= len(raw)
+
+    def close_captures(self, force=False):
+        for capture in [c for c in self.captures if force or c['remaining'] <= 0]:
+            self.captures.remove(capture)
+            recorder = capture.pop('recorder')
+            recorder.finish()
+            self.closing.append(recorder)
+            capture['file'] = recorder.segment_name(0)
+            self.events.append(capture)
+        # поток записи нельзя отпускать, пока он не закончил файл
+        self.closing = [
+            recorder for recorder in self.closing if not recorder.isFinished()]
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.close_captures(force=True)
+            closing, self.closing = self.closing, []
+        for recorder in closing:
+            recorder.wait()
+
+
+class SequenceMonitor:
+    def __init__(self, header=1, lock_packets=256, window=65_536, max_events=1_024):
+        self.header = header
+        # пакетов подряд без потерь для захвата ритма time_src. Номер пакета
+        # восстанавливается, пока период заметно больше такта (до ~45 000 пакетов/с
+        # при 20 мкс); ближе к одному такту соседние пакеты по time_src неразличимы
+        self.lock_packets = lock_packets
+        # на сколько пакетов назад опоздавший пакет ещё закрывает пропуск
+        self.window = window
+        self.events = deque(maxlen=max_events)
+        self.reset()
+
+    def reset(self):
+        self.packets = 0
+        self.gaps = 0
+        self.missing = 0
+        self.recovered = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.invalid = 0
+        self.events.clear()
+        self.unlock()
+
+    def unlock(self):
+        # до захвата ритма пакеты только копятся, потери по ним не считаются
+        self.waiting = np.zeros(0, np.int64)
+        self.origin = None
+        self.period = None
+        self.phase = 0.0
+        self.fit = np.zeros(5)
+        self.last_index = -1
+        # номера пропущенных пакетов и пакеты, перед которыми стоит их метка
+        self.pending = np.zeros(0, np.int64)
+        self.owners = np.zeros(0, np.int64)
+        self.markers = {}
+
+    @property
+    def lost(self):
+        return self.missing - self.recovered
+
+    def check(self, frames):
+        count = len(frames)
+        if self.header is None:
+            offsets = np.arange(count)
+        else:
+            offsets = np.flatnonzero(frames['pack_header'][:, 0] == self.header)
+        report = {
+            'offsets': [], 'missing': [], 'times': [], 'filled': [],
+            'duplicates': 0, 'reordered': 0, 'recovered': 0,
+            'invalid': count - len(offsets),
+        }
+        packets = self.packets
+        self.packets += count
+        self.invalid += report['invalid']
+        times = frames['time_src'][offsets, 0].astype(np.int64)
+
+        position = 0
+        while position < len(times):
+            if self.period is None:
+                position = self.lock(times, position)
+                continue
+            # пока оценка периода грубая, куски короткие, чтобы ошибка не набегала
+            stop = position + max(8, int(self.fit[0]) // 4)
+            if self.track(times[position:stop], offsets[position:stop], packets, report):
+                position = stop
+            else:
+                self.unlock()
+
+        for key in ('offsets', 'missing', 'times', 'filled'):
+            report[key] = np.array(report[key], np.int64)
+        return report
+
+    def lock(self, times, position):
+        # ритм ищется по окну из lock_packets последовательных time_src, которые
+        # ложатся на решётку floor(phase + n * period) без пропусков
+        capacity = 8 * self.lock_packets
+        stop = position + capacity
+        self.waiting = np.unique(
+            np.concatenate((self.waiting, times[position:stop])))[-capacity:]
+        # при частых потерях длинного окна может не найтись, тогда окно короче
+        sizes = [self.lock_packets]
+        if len(self.waiting) == capacity:
+            sizes += [self.lock_packets // 2, self.lock_packets // 4, self.lock_packets // 8]
+        for size in sizes:
+            window = self.find_lattice(size)
+            if window is not None:
+                break
+        else:
+            return stop
+
+        self.origin = int(window[0])
+        self.update_fit(np.arange(size), window - self.origin + 0.5)
+        # накопленные пакеты после окна уже пришли, с них и начинается проверка
+        self.last_index = int(np.rint(
+            (self.waiting[-1] - self.origin + 0.5 - self.phase) / self.period))
+        self.waiting = np.zeros(0, np.int64)
+        return stop
+
+    def find_lattice(self, size):
+        if len(self.waiting) < size:
+            return None
+        # без потерь шаги time_src принимают только значения floor(period) и
+        # ceil(period), остальные окна отбрасываются до подгонки прямой
+        steps = np.lib.stride_tricks.sliding_window_view(np.diff(self.waiting), size - 1)
+        candidates = np.flatnonzero(steps.max(axis=1) - steps.min(axis=1) <= 1)[-64:]
+        if not len(candidates):
+            return None
+        windows = np.lib.stride_tricks.sliding_window_view(self.waiting, size)[candidates]
+        n = np.arange(size) - (size - 1) / 2
+        tau = windows - windows[:, :1] + 0.5
+        period = (tau * n).sum(axis=1) / (n * n).sum()
+        residual = tau - tau.mean(axis=1, keepdims=True) - period[:, None] * n
+        valid = np.flatnonzero((period >= 1) & (np.abs(residual).max(axis=1) <= 0.5))
+        return windows[valid[-1]] if len(valid) else None
+
+    def update_fit(self, index, tau):
+        # период и фаза - прямая по методу наименьших квадратов через все пакеты
+        index = index.astype(np.float64)
+        self.fit += (len(index), index.sum(), tau.sum(),
+                     (index * index).sum(), (index * tau).sum())
+        count, sum_index, sum_tau, sum_squares, sum_products = self.fit
+        self.period = (count * sum_products - sum_index * sum_tau) \
+            / (count * sum_squares - sum_index * sum_index)
+        self.phase = (sum_tau - self.period * sum_index) / count
+
+    def release(self, owners):
+        # возвращает метки, у которых не осталось незакрытых пропусков
+        released = []
+        for owner, count in zip(*np.unique(owners, return_counts=True)):
+            owner = int(owner)
+            self.markers[owner] -= int(count)
+            if not self.markers[owner]:
+                del self.markers[owner]
+                released.append(owner)
+        return released
+
+    def track(self, times, offsets, packets, report):
+        # номер пакета восстанавливается по time_src, поэтому потери считаются по
+        # накопленному числу тактов, а не по порогу на отдельный шаг
+        tau = times - self.origin + 0.5
+        index = np.rint((tau - self.phase) / self.period).astype(np.int64)
+        last = self.last_index
+        if index.min() < last - self.window:
+            # time_src ушёл назад: источник перезапущен, ритм захватывается заново
+            return False
+
+        unique, first, inverse = np.unique(index, return_index=True, return_inverse=True)
+        old = unique <= last
+        slots = np.searchsorted(self.pending, unique)
+        slots = np.minimum(slots, max(len(self.pending) - 1, 0))
+        filled = old & (self.pending[slots] == unique) if len(self.pending) \
+            else np.zeros(len(unique), bool)
+        repeated = old & ~filled
+        is_first = np.zeros(len(index), bool)
+        is_first[first] = True
+        running = np.maximum.accumulate(np.concatenate(([last], index)))[:-1]
+        reordered = int(np.count_nonzero(is_first & (index < running) & ~repeated[inverse]))
+        duplicates = len(index) - len(unique) + int(np.count_nonzero(repeated))
+        report['duplicates'] += duplicates
+        report['reordered'] += reordered
+        self.duplicates += duplicates
+        self.reordered += reordered
+
+        # опоздавший пакет закрывает пропуск, метка снимается вместе с последним
+        removed = self.release(self.owners[slots[filled]])
+        keep = np.ones(len(self.pending), bool)
+        keep[slots[filled]] = False
+        self.pending, self.owners = self.pending[keep], self.owners[keep]
+        recovered = int(np.count_nonzero(filled))
+        report['recovered'] += recovered
+        self.recovered += recovered
+        if removed:
+            report['filled'].extend(owner - packets for owner in removed)
+            self.gaps -= len(removed)
+            removed = set(removed)
+            self.events = deque(
+                (event for event in self.events if event[0] not in removed),
+                maxlen=self.events.maxlen)
+
+        fresh = unique[~old]
+        if len(fresh):
+            arrived = first[~old]
+            steps = np.diff(np.concatenate(([last], fresh)))
+            top = fresh[-1]
+            pending, owners = [self.pending], [self.owners]
+            for hole in np.flatnonzero(steps > 1):
+                missing = int(steps[hole]) - 1
+                owner = packets + int(offsets[arrived[hole]])
+                # далёкие пропуски уже не закрыть, они только учитываются
+                indices = np.arange(max(fresh[hole] - missing, top - self.window),
+                                    fresh[hole])
+                if len(indices):
+                    pending.append(indices)
+                    owners.append(np.full(len(indices), owner))
+                    self.markers[owner] = len(indices)
+                report['offsets'].append(owner - packets)
+                report['times'].append(int(times[arrived[hole]]))
+                report['missing'].append(missing)
+                self.events.append((owner, int(times[arrived[hole]]), missing))
+                self.gaps += 1
+                self.missing += missing
+            self.pending = np.concatenate(pending)
+            self.owners = np.concatenate(owners)
+            self.last_index = int(top)
+
+            expired = self.pending <= top - self.window
+            self.release(self.owners[expired])
+            self.pending, self.owners = self.pending[~expired], self.owners[~expired]
+
+        accepted = is_first & ~repeated[inverse]
+        self.update_fit(index[accepted], tau[accepted])
+        return True
+
+
+class Histogram:
+    def __init__(self, edges):
+        self.edges = edges
+        self.clear()
+
+    def clear(self):
+        self.counts = [0] * (len(self.edges) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, value):
+        # только bisect и счётчики: запись дешевле самого вызова perf_counter
+        self.counts[bisect.bisect_left(self.edges, value)] += 1
+        self.count += 1
+        self.total += value
+        self.last = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                # верхняя граница корзины, но не больше наблюдавшегося максимума
+                return min(self.edges[index], self.max) \
+                    if index < len(self.edges) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+            'last': self.last,
+        }
+
+
+class PipelineStats:
+    # корзины по времени: от 1 мкс до ~16 с с шагом sqrt(2)
+    time_edges = [1e-6 * 2 ** (i / 2) for i in range(48)]
+    size_edges = [2 ** i for i in range(24)]
+
+    def __init__(self, enabled=True, prefix=''):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.histograms = {}
+        self.units = {}
+        self.started = time.monotonic()
+
+    def histogram(self, name, edges, unit):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(edges)
+            self.units[name] = unit
+        return histogram
+
+    def add_time(self, name, seconds):
+        if self.enabled:
+            self.histogram(self.prefix + name, self.time_edges, 's').add(seconds)
+
+    def add_size(self, name, value):
+        if self.enabled:
+            self.histogram(self.prefix + name, self.size_edges, 'n').add(value)
+
+    def child(self, prefix):
+        # гистограммы общие, у каждого источника только свой префикс имён
+        stats = PipelineStats(self.enabled, self.prefix + prefix)
+        stats.histograms = self.histograms
+        stats.units = self.units
+        return stats
+
+    def clear(self):
+        for histogram in list(self.histograms.values()):
+            histogram.clear()
+        self.started = time.monotonic()
+
+    def snapshot(self, buckets=False):
+        result = {}
+        # list() снимает копию разом, пока поток приёма может добавить гистограмму
+        for name, histogram in list(self.histograms.items()):
+            result[name] = histogram.summary()
+            result[name]['unit'] = self.units[name]
+            if buckets:
+                result[name]['edges'] = histogram.edges
+                result[name]['counts'] = list(histogram.counts)
         return result
 
 
-class UpdateGrapicsThread(QThread):
-    update_signal = pyqtSignal()
+def socket_queue_bytes(port):
+    # очередь приёма сокета видна только в /proc на Linux, в остальных системах None
+    for table in ('/proc/net/udp', '/proc/net/udp6'):
+        try:
+            with open(table) as f:
+                lines = f.readlines()[1:]
+        except OSError:
+            continue
+        for line in lines:
+            fields = line.split()
+            if int(fields[1].rsplit(':', 1)[1], 16) == port:
+                return int(fields[4].split(':')[1], 16)
+    return None
 
-    def __init__(self):
+
+class AcquisitionThread(QThread):
+    def __init__(self, port, arena_slots):
         super().__init__()
+        self.port = port
+        self.arena = PacketArena(arena_slots, MainData.dt.itemsize)
+        # deque.append/popleft атомарны, поэтому GUI забирает пачки без блокировок
+        self.batches = deque()
+        self.recorder = None
+        self.trigger = None
+        self.sequence = SequenceMonitor()
+        self.stats = PipelineStats()
+        self.received_packets = 0
+        self.last_update = 0
+        # текст ошибки, из-за которой поток приёма завершился сам
+        self.error = None
 
     def run(self):
-        self.update_signal.emit()
+        self.socket = QUdpSocket()
+        if not self.socket.bind(self.port):
+            self.error = self.socket.errorString()
+            return
+        self.socket.readyRead.connect(
+            self.read_data, Qt.ConnectionType.DirectConnection)
+        self.exec()
+        self.socket.close()
+
+    def stop(self):
+        self.quit()
+        self.wait()
 
+    def read_data(self):
+        started = time.perf_counter()
+        received = self.received_packets
+        while self.socket.hasPendingDatagrams():
+            data, * _ = self.socket.readDatagram(1274)
+            if self.arena.is_full():
+                self.decode()
+            self.arena.write(data)
+            self.received_packets += 1
+        self.last_update = time.time_ns()
+        self.decode()
+        self.stats.add_size('read_packets', self.received_packets - received)
+        self.stats.add_time('read', time.perf_counter() - started)
 
-class UpdateDataThread(QThread):
-    update_signal = pyqtSignal()
+    def decode(self):
+        if not len(self.arena):
+            return
+        started = time.perf_counter()
+        self.stats.add_size('batch', len(self.arena))
+        frames = self.arena.frames(MainData.dt)
+        report = self.sequence.check(frames)
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.write(
+                self.arena.view[:len(self.arena) * self.arena.packet_size], report)
+        batch = MainData.decode(frames)
+        batch['gaps'] = report['offsets']
+        batch['filled'] = report['filled']
+        trigger = self.trigger
+        if trigger is not None:
+            # триггер проверяется здесь, а не в GUI, чтобы не зависеть от отрисовки
+            trigger_started = time.perf_counter()
+            trigger.process(batch, np.frombuffer(
+                self.arena.view[:len(self.arena) * self.arena.packet_size], np.uint8
+            ).reshape(len(self.arena), self.arena.packet_size))
+            self.stats.add_time('trigger', time.perf_counter() - trigger_started)
+        self.batches.append(batch)
+        self.arena.reset()
+        self.stats.add_time('decode', time.perf_counter() - started)
+
+    def take_batches(self):
+        while self.batches:
+            yield self.batches.popleft()
+
+    def backlog(self):
+        # очередь в пакетах, как и у процесса приёма
+        return sum(len(batch['time_src']) for batch in list(self.batches))
+
+    def failure(self):
+        return self.error
+
+
+class SocketAcquisitionThread(AcquisitionThread):
+    def __init__(self, port, arena_slots, rcvbuf=8 * 1024 * 1024):
+        super().__init__(port, arena_slots)
+        self.rcvbuf = rcvbuf
+        self.running = False
 
-    def __init__(self):
-        super().__init__()
+    def run(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.running = True
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+            sock.bind(('', self.port))
+            sock.setblocking(False)
+            while self.running:
+                if not select.select([sock], [], [], 0.1)[0]:
+                    continue
+                # датаграммы читаются прямо в слоты арены, пока очередь не опустеет
+                started = time.perf_counter()
+                received = self.received_packets
+                while not self.arena.is_full():
+                    try:
+                        self.arena.receive(sock)
+                    except BlockingIOError:
+                        break
+                    self.received_packets += 1
+                self.last_update = time.time_ns()
+                self.decode()
+                self.stats.add_size('read_packets', self.received_packets - received)
+                self.stats.add_time('read', time.perf_counter() - started)
+        except OSError as e:
+            self.error = str(e)
+        finally:
+            sock.close()
+
+    def stop(self):
+        self.running = False
+        self.wait()
+
+
+class ReplayThread(AcquisitionThread):
+    def __init__(self, index, start, speed=1.0, arena_slots=4_096, max_batches=64):
+        super().__init__(None, arena_slots)
+        self.index = index
+        self.position = start
+        self.speed = speed
+        self.max_batches = max_batches
+        self.paused = False
+        self.anchored = False
+        self.running = False
+
+    def set_speed(self, speed):
+        self.speed = speed
+        self.anchored = False
+
+    def anchor(self):
+        self.wall_start = time.perf_counter()
+        self.source_start = self.index.get_time(self.position)
+        self.anchored = True
 
     def run(self):
-        self.update_signal.emit()
+        frames = self.index.frames
+        self.running = True
+        while self.running and self.position < len(frames):
+            if self.paused or len(self.batches) > self.max_batches:
+                self.anchored = self.anchored and not self.paused
+                time.sleep(0.01)
+                continue
+            if not self.anchored:
+                self.anchor()
+
+            # пакеты выдаются по их time_src, а не по паузе после каждого пакета
+            if self.speed > 0:
+                elapsed = (time.perf_counter() - self.wall_start) * self.speed
+                due = self.index.find(
+                    self.source_start + elapsed / MainData.time_scale)
+            else:
+                due = len(frames)
+            stop = min(due, self.position + self.arena.slots)
+            if stop > self.position:
+                self.arena.write_frames(frames[self.position:stop])
+                self.received_packets += stop - self.position
+                self.last_update = time.time_ns()
+                self.decode()
+                self.position = stop
+                continue
+
+            delay = (self.index.get_time(self.position) - self.source_start) \
+                * MainData.time_scale / self.speed \
+                - (time.perf_counter() - self.wall_start)
+            time.sleep(min(max(delay, 0.001), 0.05))
+
+    def stop(self):
+        self.running = False
+        self.wait()
+
+
+def ring_slices(start, count, capacity):
+    first = start % capacity
+    end = first + count
+    if end <= capacity:
+        return [(slice(first, end), slice(0, count))]
+    split = capacity - first
+    return [(slice(first, capacity), slice(0, split)),
+            (slice(0, end - capacity), slice(split, count))]
+
+
+class SharedColumns:
+    counters = [
+        'committed', 'reserved', 'gaps_committed', 'gaps_reserved', 'stop',
+        'last_update', 'packets', 'missing', 'recovered', 'gaps', 'duplicates',
+        'reordered', 'invalid'
+    ]
+    gap_capacity = 4_096
+
+    def __init__(self, capacity, name=None):
+        self.capacity = capacity
+        # раскладка блока одинаково вычисляется в обоих процессах
+        sample = MainData.decode(np.zeros(1, MainData.dt))
+        layout = [('header', np.int64, (len(self.counters), ))]
+        layout += [
+            (field, value.dtype, (capacity, *value.shape[1:]))
+            for field, value in sample.items()
+        ]
+        layout += [('gaps', np.int64, (self.gap_capacity, 3))]
+        offsets = []
+        size = 0
+        for _, dtype, shape in layout:
+            offsets.append(size)
+            size += -(-int(np.prod(shape)) * np.dtype(dtype).itemsize // 64) * 64
+
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.arrays = {
+            field: np.ndarray(shape, dtype, buffer=self.memory.buf, offset=offset)
+            for (field, dtype, shape), offset in zip(layout, offsets)
+        }
+        self.header = self.arrays.pop('header')
+        self.fields = list(sample)
+        if name is None:
+            self.header[:] = 0
+
+    def get(self, counter):
+        return int(self.header[self.counters.index(counter)])
+
+    def set(self, counter, value):
+        self.header[self.counters.index(counter)] = value
+
+    def write(self, batch, gaps):
+        start = self.get('committed')
+        count = len(batch['time_src'])
+        # reserved публикуется до записи: по нему читатель узнаёт строки,
+        # которые могли измениться, пока он их копировал
+        self.set('reserved', start + count)
+        for dst, src in ring_slices(start, count, self.capacity):
+            for field in self.fields:
+                self.arrays[field][dst] = batch[field][src]
+        if len(gaps):
+            gaps_start = self.get('gaps_committed')
+            gaps = gaps[-self.gap_capacity:]
+            self.set('gaps_reserved', gaps_start + len(gaps))
+            for dst, src in ring_slices(gaps_start, len(gaps), self.gap_capacity):
+                self.arrays['gaps'][dst] = gaps[src]
+            self.set('gaps_committed', gaps_start + len(gaps))
+        # счётчик публикуется последним: читатель видит только записанные данные
+        self.set('committed', start + count)
+
+    def close(self, unlink=False):
+        self.arrays = None
+        self.header = None
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+def create_attached(kind, params):
+    if kind == 'trigger':
+        return TriggerEngine(**params)
+    params = dict(params)
+    files = params.pop('files')
+    recorder = RecorderThread(dtype=MainData.dt, **params)
+    # сегменты продолжают нумерацию файлов предыдущих запусков приёма
+    recorder.files = files
+    recorder.start()
+    return recorder
+
+
+def forward_events(trigger, results):
+    while trigger.events:
+        results.put(('event', 'trigger', trigger.events.popleft()))
+
+
+def release_attached(kind, target, results):
+    target.stop()
+    if kind == 'trigger':
+        forward_events(target, results)
+        return {'error': target.error, 'triggered': target.triggered}
+    return {'files': target.files, 'error': target.error,
+            'dropped_packets': target.dropped_packets}
+
+
+def run_decode_process(name, capacity, port, rcvbuf, arena_slots, header,
+                       commands, results):
+    shared = SharedColumns(capacity, name)
+    arena = PacketArena(arena_slots, MainData.dt.itemsize)
+    sequence = SequenceMonitor(header)
+    # запись и триггер работают здесь по каждой принятой пачке: если окно
+    # не успевает читать кольцо, в файле и в проверке условия нет пропусков
+    attached = {'recorder': None, 'trigger': None}
+    reported = set()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    sock.bind(('', port))
+    sock.setblocking(False)
+    try:
+        while not shared.get('stop'):
+            while True:
+                try:
+                    kind, params = commands.get_nowait()
+                except queue.Empty:
+                    break
+                if attached[kind] is not None:
+                    results.put(('detached', kind,
+                                 release_attached(kind, attached[kind], results)))
+                    reported.discard(kind)
+                attached[kind] = None if params is None else create_attached(kind, params)
+            for kind, target in attached.items():
+                if target is not None and target.error is not None \
+                        and kind not in reported:
+                    results.put(('error', kind, target.error))
+                    reported.add(kind)
+
+            if not select.select([sock], [], [], 0.1)[0]:
+                continue
+            while not arena.is_full():
+                try:
+                    arena.receive(sock)
+                except BlockingIOError:
+                    break
+            if not len(arena):
+                continue
+
+            frames = arena.frames(MainData.dt)
+            start = shared.get('committed')
+            report = sequence.check(frames)
+            # закрытая метка передаётся строкой с нулём пропущенных пакетов:
+            # номер пакета пачки и номер пакета, перед которым стояла метка
+            filled = start + report['filled']
+            gaps = np.concatenate((
+                np.column_stack(
+                    (start + report['offsets'], report['times'], report['missing'])),
+                np.column_stack(
+                    (np.full(len(filled), start), filled, np.zeros(len(filled), np.int64)))))
+            raw = np.frombuffer(
+                arena.view[:len(arena) * arena.packet_size], np.uint8
+            ).reshape(len(arena), arena.packet_size)
+            recorder = attached['recorder']
+            if recorder is not None:
+                recorder.write(raw.reshape(-1), report)
+            batch = MainData.decode(frames)
+            trigger = attached['trigger']
+            if trigger is not None:
+                batch['gaps'] = report['offsets']
+                batch['filled'] = report['filled']
+                trigger.process(batch, raw)
+                forward_events(trigger, results)
+            shared.write(batch, gaps)
+            for counter in ('packets', 'missing', 'recovered', 'gaps', 'duplicates',
+                            'reordered', 'invalid'):
+                shared.set(counter, getattr(sequence, counter))
+            shared.set('last_update', time.time_ns())
+            arena.reset()
+    finally:
+        for kind, target in attached.items():
+            if target is not None:
+                results.put(('detached', kind, release_attached(kind, target, results)))
+        sock.close()
+        shared.close()
+
+
+class ProcessAcquisition:
+    # приём и декодирование в отдельном процессе, столбцы передаются через общую память
+    def __init__(self, port, arena_slots, rcvbuf=8 * 1024 * 1024, capacity=65_536):
+        self.port = port
+        self.capacity = capacity
+        self.arena_slots = min(arena_slots, capacity)
+        self.rcvbuf = rcvbuf
+        # объекты окна; сами запись и триггер работают в дочернем процессе,
+        # а сюда возвращаются их файлы, события и ошибки
+        self.attached = {'recorder': None, 'trigger': None}
+        self.waiting = set()
+        self.commands = None
+        self.results = None
+        self.sequence = SequenceMonitor()
+        self.stats = PipelineStats()
+        self.batches = deque()
+        self.shared = None
+        self.process = None
+        self.position = 0
+        self.gaps_position = 0
+        self.received_packets = 0
+        self.last_update = 0
+
+    @property
+    def recorder(self):
+        return self.attached['recorder']
+
+    @recorder.setter
+    def recorder(self, recorder):
+        self.attach('recorder', recorder)
+
+    @property
+    def trigger(self):
+        return self.attached['trigger']
+
+    @trigger.setter
+    def trigger(self, trigger):
+        self.attach('trigger', trigger)
+
+    def start(self):
+        self.shared = SharedColumns(self.capacity)
+        # spawn: дочерний процесс не наследует потоки и состояние Qt
+        context = multiprocessing.get_context('spawn')
+        self.commands = context.Queue()
+        self.results = context.Queue()
+        self.process = context.Process(
+            target=run_decode_process, daemon=True,
+            args=(self.shared.memory.name, self.capacity, self.port, self.rcvbuf,
+                  self.arena_slots, self.sequence.header, self.commands, self.results))
+        self.process.start()
+        for kind, target in self.attached.items():
+            if target is not None:
+                self.send_attached(kind, target)
+
+    def stop(self):
+        if self.shared is None:
+            return
+        self.shared.set('stop', 1)
+        # дочерний процесс перед выходом дописывает файлы и присылает итоги
+        deadline = time.monotonic() + 10
+        while self.process.is_alive() and time.monotonic() < deadline:
+            self.poll_results(0.05)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.poll_results()
+        self.batches.extend(self.read_shared())
+        self.shared.close(unlink=True)
+        self.shared = None
+
+    def attach(self, kind, target):
+        if self.attached[kind] is target:
+            return
+        running = self.shared is not None and self.process.is_alive()
+        if self.attached[kind] is not None and running:
+            self.waiting.add(kind)
+            self.commands.put((kind, None))
+            # окно ждёт итог, чтобы сразу показать файлы и ошибки
+            while kind in self.waiting and self.process.is_alive():
+                self.poll_results(0.05)
+            self.poll_results()
+            self.waiting.discard(kind)
+        self.attached[kind] = target
+        if target is not None and running:
+            self.send_attached(kind, target)
+
+    def send_attached(self, kind, target):
+        if target.error is not None:
+            return
+        if kind == 'trigger':
+            if target.stopped:
+                return
+            params = {
+                'expression': target.expression, 'mode': target.mode,
+                'pre': target.pre, 'post': target.post, 'holdoff': target.holdoff,
+                'directory': target.directory,
+            }
+        else:
+            if target.finished:
+                return
+            params = {
+                'file_name': target.file_name, 'max_size': target.max_size,
+                'max_time': target.max_time, 'compress': target.compress,
+                'max_backlog': target.max_backlog, 'files': list(target.files),
+            }
+        self.commands.put((kind, params))
+
+    def poll_results(self, timeout=0):
+        while True:
+            try:
+                if timeout:
+                    message, kind, value = self.results.get(timeout=timeout)
+                else:
+                    message, kind, value = self.results.get_nowait()
+            except queue.Empty:
+                return
+            timeout = 0
+            target = self.attached[kind]
+            if message == 'detached':
+                self.waiting.discard(kind)
+            if target is None:
+                continue
+            if message == 'event':
+                target.events.append(value)
+            elif message == 'error':
+                target.error = value
+            elif kind == 'trigger':
+                target.triggered += value['triggered']
+                if value['error'] is not None:
+                    target.error = value['error']
+            else:
+                target.files = value['files']
+                target.dropped_packets += value['dropped_packets']
+                if value['error'] is not None:
+                    target.error = value['error']
+
+    def update_counters(self):
+        shared = self.shared
+        self.received_packets = shared.get('packets')
+        self.last_update = shared.get('last_update')
+        for counter in ('packets', 'missing', 'recovered', 'gaps', 'duplicates',
+                        'reordered', 'invalid'):
+            setattr(self.sequence, counter, shared.get(counter))
+        self.poll_results()
+
+    def backlog(self):
+        queued = sum(len(batch['time_src']) for batch in self.batches)
+        if self.shared is None:
+            return queued
+        return queued + self.shared.get('committed') - self.position
+
+    def failure(self):
+        # процесс завершился без запроса остановки
+        if self.shared is None or self.process.is_alive():
+            return None
+        return f'процесс приёма завершился с кодом {self.process.exitcode}'
+
+    def take_batches(self):
+        while self.batches:
+            yield self.batches.popleft()
+        if self.shared is not None:
+            yield from self.read_shared()
+
+    def read_gaps(self):
+        shared = self.shared
+        gaps_committed = shared.get('gaps_committed')
+        gaps_start = max(self.gaps_position, gaps_committed - shared.gap_capacity)
+        gaps = np.concatenate([
+            shared.arrays['gaps'][dst]
+            for dst, _ in ring_slices(
+                gaps_start, gaps_committed - gaps_start, shared.gap_capacity)
+        ])
+        self.gaps_position = gaps_committed
+        # строки, перезаписанные во время копирования, отбрасываются
+        overwritten = shared.get('gaps_reserved') - shared.gap_capacity - gaps_start
+        return gaps[max(overwritten, 0):]
+
+    def read_shared(self):
+        shared = self.shared
+        self.update_counters()
+        committed = shared.get('committed')
+        if committed - self.position > self.capacity:
+            # писатель обогнал GUI на целое кольцо, старые пакеты уже перезаписаны
+            self.stats.add_size('overrun', committed - self.capacity - self.position)
+            self.position = committed - self.capacity
+        gaps = self.read_gaps()
+
+        start = self.position
+        for dst, src in ring_slices(start, committed - start, self.capacity):
+            first = start + src.start
+            batch = {field: shared.arrays[field][dst].copy() for field in shared.fields}
+            # пока строки копировались, писатель мог занять их место в кольце:
+            # такие строки отбрасываются, как при обгоне
+            overwritten = min(max(shared.get('reserved') - self.capacity - first, 0),
+                              src.stop - src.start)
+            if overwritten:
+                self.stats.add_size('overrun', overwritten)
+                batch = {field: value[overwritten:] for field, value in batch.items()}
+                first += overwritten
+            count = src.stop - src.start - overwritten
+            if not count:
+                continue
+            selected = gaps[(gaps[:, 0] >= first) & (gaps[:, 0] < first + count)]
+            batch['gaps'] = selected[selected[:, 2] > 0, 0] - first
+            batch['filled'] = selected[selected[:, 2] == 0, 1] - first
+            yield batch
+        self.position = committed
+
+
+class RenderScheduler:
+    def __init__(self, main_window, fps=30, min_fps=5):
+        self.main_window = main_window
+        self.fps = fps
+        self.min_fps = min(min_fps, fps)
+        self.current_fps = fps
+        self.last_frame = None
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.render_frame)
+
+    def start(self):
+        self.current_fps = self.fps
+        self.last_frame = None
+        self.timer.start(int(1000 / self.current_fps))
+
+    def stop(self):
+        self.timer.stop()
+
+    def render_frame(self):
+        started = time.perf_counter()
+        # при заморозке данные принимаются, но графики не перерисовываются
+        if self.main_window.update_data() and not self.main_window.frozen:
+            self.main_window.update_all_graphics(only_changed=True)
+        elapsed = time.perf_counter() - started
+        stats = self.main_window.stats
+        stats.add_time('frame', elapsed)
+        if self.last_frame is not None:
+            stats.add_time('frame_interval', started - self.last_frame)
+        self.last_frame = started
+
+        # под нагрузкой частота кадров снижается, чтобы отрисовка не съедала весь GUI-поток
+        budget = 1 / self.current_fps
+        if elapsed > 0.8 * budget and self.current_fps > self.min_fps:
+            self.set_fps(max(self.min_fps, self.current_fps * 0.75))
+        elif elapsed < 0.4 * budget and self.current_fps < self.fps:
+            self.set_fps(min(self.fps, self.current_fps * 1.25))
+
+    def set_fps(self, fps):
+        self.current_fps = fps
+        self.timer.setInterval(int(1000 / fps))
 
 
 class IndicatorLabel(QLabel):
@@ -254,34 +2347,313 @@ class IndicatorLabel(QLabel):
         pixmap.fill(Qt.GlobalColor.green)
         self.setPixmap(pixmap)
 
+    def set_yellow(self):
+        pixmap = QPixmap(30, 30)
+        pixmap.fill(Qt.GlobalColor.yellow)
+        self.setPixmap(pixmap)
+
+
+class DataSource:
+    def __init__(self, name, port, data):
+        self.name = name
+        self.port = port
+        self.data = data
+        self.thread = None
+
+    @classmethod
+    def parse(cls, value, data):
+        # источник задаётся строкой "имя=порт" или просто номером порта
+        name, _, port = value.rpartition('=')
+        return cls(name.strip() or port.strip(), int(port), data)
+
+
+class StatsDock(QDockWidget):
+    headers = ['Этап', 'Вызовов', 'Среднее', 'p50', 'p95', 'p99', 'Макс']
+
+    def __init__(self, main_window):
+        super().__init__('Производительность', main_window)
+        self.main_window = main_window
+        self.previous = None
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+
+        self.summary_label = QLabel()
+        layout.addWidget(self.summary_label)
+        self.stats_table = QTableWidget(0, len(self.headers))
+        self.stats_table.setHorizontalHeaderLabels(self.headers)
+        self.stats_table.verticalHeader().hide()
+        layout.addWidget(self.stats_table, 2)
+        self.memory_table = QTableWidget(0, 2)
+        self.memory_table.setHorizontalHeaderLabels(['Канал', 'Память, КБ'])
+        self.memory_table.verticalHeader().hide()
+        layout.addWidget(self.memory_table, 1)
+
+        buttons = QHBoxLayout()
+        button_export = QPushButton('Экспорт')
+        button_export.clicked.connect(self.export)
+        buttons.addWidget(button_export)
+        button_clear = QPushButton('Сброс')
+        button_clear.clicked.connect(self.clear)
+        buttons.addWidget(button_clear)
+        layout.addLayout(buttons)
+        self.setWidget(widget)
+
+        # таблицы обновляются только пока панель видна
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(self.visibility_handler)
+
+    def visibility_handler(self, visible):
+        if visible:
+            self.refresh()
+            self.timer.start(1000)
+        else:
+            self.timer.stop()
+
+    def clear(self):
+        self.main_window.stats.clear()
+        self.previous = None
+        self.refresh()
+
+    def get_fps(self, snapshot):
+        frames = snapshot.get('frame', {}).get('count', 0)
+        now = time.monotonic()
+        previous, self.previous = self.previous, (now, frames)
+        if previous is None or now <= previous[0]:
+            return None
+        return (frames - previous[1]) / (now - previous[0])
+
+    def refresh(self):
+        snapshot = self.main_window.stats.snapshot()
+        fps = self.get_fps(snapshot)
+        memory = self.main_window.get_memory()
+        self.summary_label.setText(
+            f'Кадров в секунду: {"-" if fps is None else f"{fps:.1f}"}    '
+            f'Память буферов: {sum(memory.values()) / 1024 / 1024:.1f} МБ')
+
+        self.stats_table.setRowCount(len(snapshot))
+        for row, (name, summary) in enumerate(sorted(snapshot.items())):
+            values = [summary[key] for key in ('mean', 'p50', 'p95', 'p99', 'max')]
+            if summary['unit'] == 's':
+                texts = ['-' if value is None else f'{value * 1000:.3f} мс'
+                         for value in values]
+            else:
+                texts = ['-' if value is None else f'{value:.0f}' for value in values]
+            for column, text in enumerate([name, str(summary['count']), *texts]):
+                self.stats_table.setItem(row, column, QTableWidgetItem(text))
+
+        self.memory_table.setRowCount(len(memory))
+        for row, (name, size) in enumerate(memory.items()):
+            self.memory_table.setItem(row, 0, QTableWidgetItem(name))
+            self.memory_table.setItem(row, 1, QTableWidgetItem(f'{size / 1024:.0f}'))
+
+    def export(self):
+        options = QFileDialog.Options()
+        file_name, _ = QFileDialog.getSaveFileName(
+            self, 'Экспорт статистики', '', 'JSON (*.json)', options=options)
+        if not file_name:
+            return
+        stats = self.main_window.stats
+        with open(file_name, 'w', encoding='utf-8') as f:
+            json.dump({
+                'timestamp': time.time(),
+                'uptime': time.monotonic() - stats.started,
+                'histograms': stats.snapshot(buckets=True),
+                'memory': self.main_window.get_memory(),
+            }, f, ensure_ascii=False, indent=2)
+
+
+class ChannelStatsDock(QDockWidget):
+    headers = ['Канал', 'Последнее', 'Мин', 'Макс', 'Среднее', 'СКО', 'СКЗ']
+    keys = ['last', 'min', 'max', 'mean', 'std', 'rms']
+
+    def __init__(self, main_window):
+        super().__init__('Статистика каналов', main_window)
+        self.main_window = main_window
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+
+        self.combo_window = QComboBox()
+        self.combo_window.addItems(['Отображаемое окно', 'Вся сессия'])
+        self.combo_window.currentIndexChanged.connect(self.refresh)
+        layout.addWidget(self.combo_window)
+        self.table = QTableWidget(0, len(self.headers))
+        self.table.setHorizontalHeaderLabels(self.headers)
+        self.table.verticalHeader().hide()
+        layout.addWidget(self.table)
+        self.setWidget(widget)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(self.visibility_handler)
+
+    def visibility_handler(self, visible):
+        if visible:
+            self.refresh()
+            self.timer.start(500)
+        else:
+            self.timer.stop()
+
+    def refresh(self):
+        count = self.main_window.resolution if self.combo_window.currentIndex() == 0 \
+            else None
+        rows = [
+            (self.main_window.get_channel_name(name, source), stats)
+            for source in self.main_window.sources
+            for name, stats in source.data.get_channel_stats(count).items()
+        ]
+        self.table.setRowCount(len(rows))
+        for row, (name, stats) in enumerate(rows):
+            texts = [f'{float(stats[key]):.3f}' for key in self.keys]
+            for column, text in enumerate([name, *texts]):
+                self.table.setItem(row, column, QTableWidgetItem(text))
+
 
 class MainWindow(QMainWindow):
     def __init__(self, app):
         super().__init__()
         self.app = app
-        self.last_update = 0
         self.resolution = 50000
-        self.ui_update_interval = 0.5
-        self.last_ui_update_time = time.time()
-        self.data = MainData()
+        self.settings = QSettings('settings.ini', QSettings.IniFormat)
+        self.time_axis = self.settings.value('time_axis', False, bool)
+        sources = self.settings.value('sources', ['2015'])
+        if isinstance(sources, str):
+            sources = [sources]
+        self.sources = [
+            DataSource.parse(value, MainData(
+                self.settings.value('capacity', 51_000, int),
+                self.settings.value('vid_capacity', 4_096, int),
+                self.settings.value('edge_capacity', 262_144, int)
+            ))
+            for value in sources
+        ]
+        for source in self.sources:
+            self.apply_derived(source.data)
+        self.stats = PipelineStats(
+            self.settings.value('instrumentation', True, bool))
         self.graph_widgets = {}
         self.graph_vid_widget = None
+        self.graph_waterfall_widget = None
+        self.graph_logic_widget = None
         self.process_started = False
-        self.socket = QUdpSocket()
+        self.recorder = None
+        self.trigger = None
+        self.trigger_events = []
+        self.frozen = False
+        self.render_scheduler = RenderScheduler(
+            self, self.settings.value('fps', 30, int))
         self.received_packets = 0
+        self.lost_packets = 0
         self.packet_for_update = 50
         self.indicator_timer = QTimer(self)
         self.indicator_timer.timeout.connect(self.indicator_update)
-        self.update_graphs_threads = UpdateGrapicsThread()
-        self.update_graphs_threads.update_signal.connect(
-            self.update_all_graphics
-        )
-        self.cache = b''
-        self.update_data_threads = UpdateDataThread()
-        self.update_data_threads.update_signal.connect(self.update_data)
-        self.settings = QSettings('settings.ini', QSettings.IniFormat)
         self.initUI()
 
+    # первый источник основной: запись, воспроизведение и видеосигнал работают с ним
+    @property
+    def data(self):
+        return self.sources[0].data
+
+    @data.setter
+    def data(self, data):
+        self.sources[0].data = data
+
+    @property
+    def acquisition_thread(self):
+        return self.sources[0].thread
+
+    @acquisition_thread.setter
+    def acquisition_thread(self, thread):
+        self.sources[0].thread = thread
+
+    def get_channel_name(self, channel, source):
+        return channel if source is self.sources[0] else f'{channel} [{source.name}]'
+
+    def get_channel_names(self):
+        return [
+            self.get_channel_name(channel, source)
+            for source in self.sources for channel in source.data
+        ]
+
+    def get_channel(self, name):
+        if name.endswith(']') and ' [' in name:
+            channel, source_name = name[:-1].rsplit(' [', 1)
+            for source in self.sources[1:]:
+                if source.name == source_name and channel in source.data.channels:
+                    return source.data, channel
+        if name in self.data.channels:
+            return self.data, name
+        return None, None
+
+    def apply_derived(self, data):
+        for name, expression in self.settings.value('derived_channels', {}).items():
+            try:
+                data.add_derived(name, expression)
+            except ValueError:
+                continue
+
+    def add_derived_channel(self):
+        name, ok_pressed = QInputDialog.getText(
+            self, 'Производный канал', 'Имя канала: ')
+        if not ok_pressed or not name:
+            return
+        expression, ok_pressed = QInputDialog.getText(
+            self, 'Производный канал', 'Выражение, например curr_27V * u27V_del: ')
+        if not ok_pressed or not expression:
+            return
+
+        added = []
+        try:
+            for source in self.sources:
+                source.data.add_derived(name, expression)
+                added.append(source.data)
+        except ValueError as error:
+            for data in added:
+                data.remove_derived(name)
+            QMessageBox.warning(self, 'Внимание', str(error))
+            return
+
+        current_values = self.settings.value('derived_channels', {})
+        current_values[name] = expression
+        self.settings.setValue('derived_channels', current_values)
+        self.left_widget.update_checkbox()
+
+    def derived_failed(self, name, error):
+        self.left_widget.update_checkbox()
+        QMessageBox.warning(
+            self, 'Внимание', f'Производный канал {name} отключён: {error}')
+
+    def delete_derived_channel(self, name):
+        dependent = [
+            channel.name for channel in self.data.derived.values()
+            if name in channel.names
+        ]
+        if dependent:
+            QMessageBox.warning(
+                self, 'Внимание', f'Канал {name} используется в канале {dependent[0]}')
+            return
+
+        qualified = {
+            self.get_channel_name(name, source) for source in self.sources}
+        for names in list(self.graph_widgets):
+            if qualified.intersection(names):
+                self.delete_graph_window(names)
+        for source in self.sources:
+            if name in source.data.derived:
+                source.data.remove_derived(name)
+
+        current_values = self.settings.value('derived_channels', {})
+        current_values.pop(name, None)
+        self.settings.setValue('derived_channels', current_values)
+        self.left_widget.update_checkbox()
+
+    def get_memory(self):
+        return {
+            self.get_channel_name(channel, source): size
+            for source in self.sources
+            for channel, size in source.data.get_memory().items()
+        }
+
     def initUI(self):
         self.setWindowTitle("VID GRAPH UPD v.2024.03.29")
         self.setGeometry(0, 0, 1350, 768)
@@ -346,11 +2718,19 @@ class MainWindow(QMainWindow):
         self.slider_resolution.valueChanged.connect(
             self.slider_resolution_handler)
         toolbar.addWidget(self.slider_resolution)
+        self.button_time_axis = QPushButton('Ось времени')
+        self.button_time_axis.setCheckable(True)
+        self.button_time_axis.setChecked(self.time_axis)
+        self.button_time_axis.clicked.connect(self.time_axis_handler)
+        toolbar.addWidget(self.button_time_axis)
 
         toolbar.addSeparator()
         toolbar.addWidget(QLabel(' Пакетов получено: '))
         self.received_packets_label = QLabel(str(self.received_packets))
         toolbar.addWidget(self.received_packets_label)
+        toolbar.addWidget(QLabel(' Потеряно: '))
+        self.lost_packets_label = QLabel('0')
+        toolbar.addWidget(self.lost_packets_label)
 
         toolbar.addSeparator()
         self.indicator_label = IndicatorLabel()
@@ -361,6 +2741,12 @@ class MainWindow(QMainWindow):
             'Показать видеосигнал')
         button_create_vid_graph.clicked.connect(self.create_vid_graph)
         toolbar.addWidget(button_create_vid_graph)
+        button_create_waterfall = QPushButton('Водопад')
+        button_create_waterfall.clicked.connect(self.create_waterfall_graph)
+        toolbar.addWidget(button_create_waterfall)
+        button_create_logic = QPushButton('Битовые флаги')
+        button_create_logic.clicked.connect(self.create_logic_graph)
+        toolbar.addWidget(button_create_logic)
 
         toolbar.addSeparator()
         button_create_graphs_window = QPushButton(
@@ -380,19 +2766,68 @@ class MainWindow(QMainWindow):
         self.update_view_menu()
         toolbar.addSeparator()
 
-        button_save = QPushButton('Сохранить данные')
-        button_save.clicked.connect(self.save_data)
-        toolbar.addWidget(button_save)
+        self.button_save = QPushButton('Записать данные')
+        self.button_save.setCheckable(True)
+        self.button_save.clicked.connect(self.save_data)
+        toolbar.addWidget(self.button_save)
+        toolbar.addSeparator()
+
+        self.button_trigger = QPushButton('Триггер')
+        self.button_trigger.setCheckable(True)
+        self.button_trigger.clicked.connect(self.trigger_handler)
+        toolbar.addWidget(self.button_trigger)
+        self.trigger_label = QLabel(' Событий: 0')
+        toolbar.addWidget(self.trigger_label)
+        self.button_freeze = QPushButton('Заморозка')
+        self.button_freeze.setCheckable(True)
+        self.button_freeze.clicked.connect(self.freeze_handler)
+        toolbar.addWidget(self.button_freeze)
         toolbar.addSeparator()
 
         button_open = QPushButton('Загрузить данные')
         button_open.clicked.connect(self.open_data)
         toolbar.addWidget(button_open)
 
+        toolbar.addWidget(QLabel(' Позиция:'))
+        self.slider_position = QSlider(Qt.Orientation.Horizontal)
+        self.slider_position.setFixedSize(200, 40)
+        self.slider_position.setTracking(False)
+        self.slider_position.valueChanged.connect(
+            self.slider_position_handler)
+        toolbar.addWidget(self.slider_position)
+        self.position_label = QLabel()
+        toolbar.addWidget(self.position_label)
+        self.button_seek_time = QPushButton('Перейти ко времени')
+        self.button_seek_time.clicked.connect(self.seek_time)
+        toolbar.addWidget(self.button_seek_time)
+        self.button_replay = QPushButton('Воспроизведение')
+        self.button_replay.setCheckable(True)
+        self.button_replay.clicked.connect(self.replay_handler)
+        toolbar.addWidget(self.button_replay)
+        self.combo_speed = QComboBox()
+        for text, speed in (('×1', 1), ('×10', 10), ('×100', 100), ('Максимум', 0)):
+            self.combo_speed.addItem(text, speed)
+        self.combo_speed.currentIndexChanged.connect(self.speed_handler)
+        toolbar.addWidget(self.combo_speed)
+        self.update_position_controls()
+        toolbar.addSeparator()
+
+        self.stats_dock = StatsDock(self)
+        self.stats_dock.hide()
+        self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, self.stats_dock)
+        toolbar.addAction(self.stats_dock.toggleViewAction())
+
+        self.channel_stats_dock = ChannelStatsDock(self)
+        self.channel_stats_dock.hide()
+        self.addDockWidget(
+            Qt.DockWidgetArea.RightDockWidgetArea, self.channel_stats_dock)
+        toolbar.addAction(self.channel_stats_dock.toggleViewAction())
+
         self.addToolBar(pos, toolbar)
 
     def clear_graphs(self):
-        self.data.clear_data()
+        for source in self.sources:
+            source.data.clear_data()
         self.update_all_graphics()
 
     def update_view_menu(self):
@@ -434,40 +2869,139 @@ class MainWindow(QMainWindow):
         self.update_view_menu()
 
     def save_data(self):
-        process_started = self.process_started
-        if process_started:
-            self.stop_process()
+        if self.recorder is not None:
+            self.stop_recording()
+            return
+
         options = QFileDialog.Options()
         file_name, _ = QFileDialog.getSaveFileName(
-            self, "Сохранить файл", "", "Pickle Files (*.pickle)", options=options)
-        if file_name:
-            try:
-                with open(file_name, 'wb') as f:
-                    pickle.dump(self.data, f)
-                    QMessageBox.information(
-                        self, 'Внимание', f'Данные сохранены в файл {file_name}'
-                    )
-            except:
-                QMessageBox.critical(
-                    self, 'Внимание', f'Не удалось записать файл {file_name}'
-                )
-        if process_started:
-            self.start_process()
+            self, "Записать в файл", "", "Файлы записи (*.vgr)", options=options)
+        if not file_name:
+            self.button_save.setChecked(False)
+            return
+        self.recorder = RecorderThread(
+            file_name, MainData.dt,
+            self.settings.value('record_max_size', 1024, int) * 1024 * 1024,
+            self.settings.value('record_max_time', 3600, int),
+            self.settings.value('record_compress', False, bool)
+        )
+        self.recorder.start()
+        if self.acquisition_thread is not None:
+            self.acquisition_thread.recorder = self.recorder
+        self.button_save.setText('Остановить запись')
+
+    def stop_recording(self):
+        if self.acquisition_thread is not None:
+            self.acquisition_thread.recorder = None
+        recorder = self.recorder
+        recorder.stop()
+        self.recorder = None
+        self.button_save.setChecked(False)
+        self.button_save.setText('Записать данные')
+        if recorder.error is not None:
+            QMessageBox.critical(
+                self, 'Внимание',
+                f'Ошибка записи в файл {recorder.file_name}: {recorder.error}'
+            )
+            return
+        message = f'Данные сохранены в файлы: {", ".join(recorder.files)}'
+        if recorder.dropped_packets:
+            message += f'<br>Не записано пакетов: {recorder.dropped_packets}'
+        QMessageBox.information(self, 'Внимание', message)
+
+    def trigger_handler(self, checked):
+        if not checked:
+            self.stop_trigger()
+            return
+
+        expression, ok_pressed = QInputDialog.getText(
+            self, 'Триггер', 'Условие, например EA > 10 and not off_CU: ',
+            text=self.settings.value('trigger_expression', ''))
+        if not ok_pressed or not expression:
+            self.button_trigger.setChecked(False)
+            return
+        modes = list(TriggerEngine.modes)
+        mode, ok_pressed = QInputDialog.getItem(
+            self, 'Триггер', 'Срабатывание: ', modes,
+            modes.index(self.settings.value('trigger_mode', modes[0])), False)
+        if not ok_pressed:
+            self.button_trigger.setChecked(False)
+            return
+
+        try:
+            trigger = TriggerEngine(
+                expression, TriggerEngine.modes[mode],
+                self.settings.value('trigger_pre', 1_000, int),
+                self.settings.value('trigger_post', 1_000, int),
+                self.settings.value('trigger_holdoff', 0, int),
+                self.settings.value('trigger_directory', 'triggers'))
+        except ValueError as error:
+            QMessageBox.warning(self, 'Внимание', str(error))
+            self.button_trigger.setChecked(False)
+            return
+        self.settings.setValue('trigger_expression', expression)
+        self.settings.setValue('trigger_mode', mode)
+        self.trigger = trigger
+        self.button_trigger.setToolTip(f'{mode}: {expression}')
+        if self.acquisition_thread is not None:
+            self.acquisition_thread.trigger = trigger
+
+    def stop_trigger(self):
+        if self.acquisition_thread is not None:
+            self.acquisition_thread.trigger = None
+        self.finish_trigger()
+        self.trigger = None
+        self.button_trigger.setChecked(False)
+        self.button_trigger.setToolTip('')
+
+    def finish_trigger(self):
+        if self.trigger is not None:
+            self.trigger.stop()
+            self.check_trigger()
+
+    def check_trigger(self):
+        trigger = self.trigger
+        if trigger is None:
+            return
+        if trigger.events:
+            while trigger.events:
+                self.trigger_events.append(trigger.events.popleft())
+            self.trigger_label.setText(f' Событий: {len(self.trigger_events)}')
+            self.trigger_label.setToolTip('<br>'.join(
+                f'{event["time"]:.3f} с: {event["file"]}'
+                for event in self.trigger_events[-20:]))
+            if self.settings.value('trigger_freeze', True, bool):
+                self.freeze_handler(True)
+        if trigger.error is not None and not trigger.stopped:
+            self.stop_trigger()
+            QMessageBox.warning(self, 'Внимание', f'Триггер отключён: {trigger.error}')
+
+    def freeze_handler(self, checked):
+        self.frozen = checked
+        self.button_freeze.setChecked(checked)
+        if not checked:
+            self.update_all_graphics()
 
     def open_data(self):
         process_started = self.process_started
         if process_started:
             self.stop_process()
+        self.stop_replay()
 
         options = QFileDialog.Options()
         file_name, _ = QFileDialog.getOpenFileName(
-            self, "Открыть файл", "", "Pickle Files (*.pickle)", options=options)
+            self, "Открыть файл", "", "Файлы записи (*.vgr *.vgr.gz)", options=options)
         if file_name:
             try:
-                with open(file_name, 'rb') as f:
-                    data = pickle.load(f)
-                    self.data = data
-                    self.update_all_graphics()
+                index = RecordIndex(RecordReader(file_name).frames)
+                data = MainData(self.data.capacity, self.data.vid_capacity,
+                                self.data.edge_capacity)
+                self.apply_derived(data)
+                data.load_source(
+                    index, len(index), self.settings.value('pack_header', 1, int))
+                self.data = data
+                self.update_position_controls()
+                self.update_all_graphics()
                 QMessageBox.information(
                     self, 'Внимание', f'Данные загружены из файла {file_name}'
                 )
@@ -475,14 +3009,109 @@ class MainWindow(QMainWindow):
                 QMessageBox.critical(
                     self, 'Внимание', f'Не удалось загрузить файл {file_name}'
                 )
-        if process_started:
+        elif process_started:
             self.start_process()
 
+    def update_position_controls(self):
+        index = self.data.source
+        enabled = index is not None and len(index) > 0
+        self.slider_position.setEnabled(enabled)
+        self.button_seek_time.setEnabled(enabled)
+        self.button_replay.setEnabled(enabled)
+        if not enabled:
+            self.position_label.setText('')
+            return
+        stop = self.data.get_packet(self.data.get_window('time_src', 1)[1])
+        self.slider_position.blockSignals(True)
+        self.slider_position.setMaximum(len(index))
+        self.slider_position.setValue(stop)
+        self.slider_position.blockSignals(False)
+        self.position_label.setText(
+            f' {index.get_time(stop - 1) * MainData.time_scale:.2f} с')
+
+    def seek_position(self, stop):
+        if self.data.source is None:
+            return
+        self.stop_replay()
+        self.data.load_source(
+            self.data.source, stop, self.settings.value('pack_header', 1, int))
+        self.update_position_controls()
+        self.update_all_graphics()
+
+    def replay_handler(self, checked):
+        if isinstance(self.acquisition_thread, ReplayThread):
+            self.acquisition_thread.paused = not checked
+            return
+        if not checked:
+            return
+        index = self.data.source
+        if self.process_started or index is None or not len(index):
+            self.button_replay.setChecked(False)
+            return
+
+        position = self.data.get_packet(self.data.get_window('time_src', 1)[1])
+        if position >= len(index):
+            self.data.load_source(index, 0, self.settings.value('pack_header', 1, int))
+            position = 0
+        thread = ReplayThread(
+            index, position, self.combo_speed.currentData(),
+            self.settings.value('arena_slots', 4_096, int))
+        thread.recorder = self.recorder
+        thread.trigger = self.trigger
+        thread.sequence.header = self.settings.value('pack_header', 1, int)
+        thread.stats = self.stats
+        self.lost_packets = 0
+        thread.finished.connect(partial(self.replay_finished, thread))
+        self.acquisition_thread = thread
+        thread.start()
+        self.indicator_timer.start(500)
+        self.render_scheduler.start()
+
+    def replay_finished(self, thread):
+        if thread is self.acquisition_thread:
+            self.stop_replay()
+
+    def stop_replay(self):
+        if not isinstance(self.acquisition_thread, ReplayThread):
+            return
+        self.render_scheduler.stop()
+        self.acquisition_thread.stop()
+        self.update_data()
+        self.update_all_graphics()
+        self.finish_trigger()
+        self.acquisition_thread = None
+        self.indicator_label.set_red()
+        self.indicator_timer.stop()
+        self.button_replay.setChecked(False)
+        self.update_position_controls()
+
+    def speed_handler(self):
+        if isinstance(self.acquisition_thread, ReplayThread):
+            self.acquisition_thread.set_speed(self.combo_speed.currentData())
+
+    def slider_position_handler(self):
+        self.seek_position(self.slider_position.value())
+
+    def seek_time(self):
+        index = self.data.source
+        if index is None or not len(index):
+            return
+        first = index.get_time(0) * MainData.time_scale
+        last = index.get_time(len(index) - 1) * MainData.time_scale
+        time_value, ok_pressed = QInputDialog.getDouble(
+            self, 'Переход ко времени', 'Время, с: ',
+            first, first, last, 3
+        )
+        if not ok_pressed:
+            return
+        self.seek_position(
+            index.find(time_value / MainData.time_scale) + self.resolution // 2)
+
     def restore_view(self, list_names):
         for names in list(self.graph_widgets):
             self.delete_graph_window(names)
         for names in list_names:
-            if not all(name in list(self.data) for name in names):
+            if not all(name in self.get_channel_names() for name in names):
                 QMessageBox.warning(
                     self, 'Внимание', 'Присутствует неверное имя графика, пересохраните пресет'
                 )
@@ -496,56 +3125,94 @@ class MainWindow(QMainWindow):
             self.settings.setValue('view_settings', current_settings)
             self.update_view_menu()
 
+    def time_axis_handler(self, checked):
+        self.time_axis = checked
+        self.settings.setValue('time_axis', checked)
+        self.update_all_graphics()
+
     def slider_resolution_handler(self):
         self.resolution = self.slider_resolution.value()
-        self.update_graphs_threads.start()
+        self.update_all_graphics()
 
     def start_process(self):
         if self.process_started:
             self.stop_process()
             return
 
+        self.stop_replay()
         self.process_started = True
+        self.data.close_source()
+        self.update_position_controls()
 
         self.start_process_action.setIcon(QIcon('stop.png'))
         self.indicator_timer.start(500)
-        self.socket.bind(2015)
-        self.socket.readyRead.connect(self.read_data)
+        # у каждого источника свой сокет, поток приёма с декодированием и хранилище
+        for source in self.sources:
+            source.thread = self.create_acquisition_thread(source.port)
+            if source is not self.sources[0]:
+                source.thread.stats = self.stats.child(f'{source.name}: ')
+        self.acquisition_thread.recorder = self.recorder
+        self.acquisition_thread.trigger = self.trigger
+        self.lost_packets = 0
+        for source in self.sources:
+            source.thread.start()
+        self.render_scheduler.start()
+
+    def create_acquisition_thread(self, port):
+        arena_slots = self.settings.value('arena_slots', 4_096, int)
+        if self.settings.value('decoder', 'thread') == 'process':
+            thread = ProcessAcquisition(
+                port, arena_slots,
+                self.settings.value('rcvbuf', 8 * 1024 * 1024, int),
+                self.settings.value('shared_capacity', 65_536, int))
+        elif self.settings.value('receiver', 'qt') == 'socket':
+            thread = SocketAcquisitionThread(
+                port, arena_slots,
+                self.settings.value('rcvbuf', 8 * 1024 * 1024, int))
+        else:
+            thread = AcquisitionThread(port, arena_slots)
+        thread.sequence.header = self.settings.value('pack_header', 1, int)
+        thread.stats = self.stats
+        return thread
+
+    def get_threads(self):
+        return [source.thread for source in self.sources if source.thread is not None]
 
     def stop_process(self):
         self.process_started = False
         self.start_process_action.setIcon(QIcon('play.png'))
-        self.socket.close()
+        self.render_scheduler.stop()
+        for thread in self.get_threads():
+            thread.stop()
+        self.update_data()
+        self.update_all_graphics()
+        self.finish_trigger()
+        for source in self.sources:
+            source.thread = None
         self.received_packets = 0
         self.received_packets_label.setText(str(self.received_packets))
+        self.lost_packets = 0
+        self.lost_packets_label.setText(str(self.lost_packets))
         self.indicator_label.set_red()
         self.indicator_timer.stop()
 
-    def read_data(self):
-        while self.socket.hasPendingDatagrams():
-            self.received_packets += 1
-
-            data, * _ = self.socket.readDatagram(1274)
-            self.cache += data
-
-            if not self.update_data_threads.isRunning():
-                self.update_data_threads.start()
-
-                if not self.update_graphs_threads.isRunning():
-                    self.update_graphs_threads.start()
-
-            current_time = time.time()
-            if current_time - self.last_ui_update_time >= self.ui_update_interval:
-                self.received_packets_label.setText(f'{self.received_packets}')
-                self.last_ui_update_time = current_time
-
-            self.last_update = time.time_ns()
-
-
     def update_data(self):
-        if self.cache:
-            self.data.add_byte_data(self.cache)
-            self.cache = b''
+        started = time.perf_counter()
+        updated = False
+        for source in self.sources:
+            if source.thread is None:
+                continue
+            source.thread.stats.add_size('backlog', source.thread.backlog())
+            for batch in source.thread.take_batches():
+                source.data.add_batch(batch)
+                updated = True
+            while source.data.errors:
+                # сообщение откладывается, чтобы не открывать диалог внутри кадра
+                QTimer.singleShot(0, partial(
+                    self.derived_failed, *source.data.errors.popleft()))
+        if updated:
+            self.stats.add_time('add_batch', time.perf_counter() - started)
+        return updated
 
     def track_graph(self) -> None:
         widgets = list(self.graph_widgets.values())
@@ -589,6 +3256,23 @@ class MainWindow(QMainWindow):
         self.graph_vid_widget = VidGraph(self)
         self.right_vid_layout.addWidget(self.graph_vid_widget)
 
+    def create_waterfall_graph(self):
+        if self.graph_waterfall_widget is not None:
+            self.graph_waterfall_widget.close()
+            self.graph_waterfall_widget = None
+        self.graph_waterfall_widget = WaterfallGraph(
+            self,
+            self.settings.value('waterfall_rows', 512, int),
+            self.settings.value('waterfall_decimation', 1, int))
+        self.right_vid_layout.addWidget(self.graph_waterfall_widget)
+
+    def create_logic_graph(self):
+        if self.graph_logic_widget is not None:
+            self.graph_logic_widget.close()
+            self.graph_logic_widget = None
+        self.graph_logic_widget = LogicGraph(self)
+        self.right_graph_layout.addWidget(self.graph_logic_widget)
+
     def delete_graph_window(self, column_name):
         if column_name not in self.graph_widgets:
             return
@@ -596,16 +3280,84 @@ class MainWindow(QMainWindow):
         del self.graph_widgets[column_name]
         self.track_graph()
 
-    def update_all_graphics(self):
-        for widget in self.graph_widgets.values():
-            widget.update_data()
+    def update_all_graphics(self, only_changed=False):
+        started = time.perf_counter()
+        widgets = list(self.graph_widgets.items())
         if self.graph_vid_widget is not None:
-            self.graph_vid_widget.update_data()
+            widgets.append(('vid', self.graph_vid_widget))
+        if self.graph_waterfall_widget is not None:
+            widgets.append(('waterfall', self.graph_waterfall_widget))
+        if self.graph_logic_widget is not None:
+            widgets.append(('logic', self.graph_logic_widget))
+        for name, widget in widgets:
+            if only_changed and (
+                    widget.visibleRegion().isEmpty() or not widget.is_changed()):
+                continue
+            widget_started = time.perf_counter()
+            widget.update_data()
+            self.stats.add_time(
+                f'graph: {name if isinstance(name, str) else ", ".join(name)}',
+                time.perf_counter() - widget_started)
+        self.stats.add_time('render', time.perf_counter() - started)
 
     def indicator_update(self):
+        for source in self.sources:
+            error = None if source.thread is None else source.thread.failure()
+            if error is not None:
+                self.stop_process()
+                QMessageBox.critical(
+                    self, 'Внимание',
+                    f'Приём на порту {source.port} остановлен: {error}')
+                return
+        threads = self.get_threads()
+        self.received_packets = sum(thread.received_packets for thread in threads)
+        self.received_packets_label.setText(f'{self.received_packets}')
+        if len(self.sources) > 1:
+            self.received_packets_label.setToolTip('<br>'.join(
+                f'{source.name}: <b>{source.thread.received_packets}</b>'
+                for source in self.sources if source.thread is not None))
+        if isinstance(self.acquisition_thread, ReplayThread):
+            self.update_position_controls()
+        self.check_trigger()
+        if self.recorder is not None and self.recorder.error is not None:
+            # об ошибке записи сообщается сразу, а не при остановке
+            self.stop_recording()
+
+        for thread in threads:
+            if thread.port is not None:
+                depth = socket_queue_bytes(thread.port)
+                if depth is not None:
+                    thread.stats.add_size('socket_queue', depth)
+
+        sequences = [thread.sequence for thread in threads]
+        lost = sum(sequence.lost for sequence in sequences)
+        expected = sum(sequence.packets for sequence in sequences) + lost
+        self.lost_packets_label.setText(
+            f'{lost} ({lost / expected:.2%})' if expected else '0')
+        interval = self.indicator_timer.interval() / 1000
+        self.lost_packets_label.setToolTip(
+            f'Разрывов: <b>{sum(sequence.gaps for sequence in sequences)}</b><br>'
+            + f'Потерь в секунду: <b>{(lost - self.lost_packets) / interval:.0f}</b><br>'
+            + f'Повторов: <b>{sum(sequence.duplicates for sequence in sequences)}</b><br>'
+            + 'Пришли не по порядку: '
+            + f'<b>{sum(sequence.reordered for sequence in sequences)}</b><br>'
+            + f'Неверный заголовок: <b>{sum(sequence.invalid for sequence in sequences)}</b>'
+        )
+        lost_now = lost > self.lost_packets
+        self.lost_packets = lost
+
+        # красный, если замолчал хотя бы один источник
         now = time.time_ns()
-        if now - self.last_update >= 1000000000:
+        silent = [
+            source.name for source in self.sources if source.thread is not None
+            and now - source.thread.last_update >= 1000000000
+        ]
+        self.indicator_label.setToolTip(
+            f'Нет данных: {", ".join(silent)}' if silent else '')
+        if silent:
             self.indicator_label.set_red()
+        elif lost_now:
+            self.indicator_label.set_yellow()
         else:
             self.indicator_label.set_green()
 
@@ -621,6 +3373,10 @@ class MainWindow(QMainWindow):
     def closeEvent(self, ev):
         if self.process_started:
             self.stop_process()
+        self.stop_replay()
+        if self.recorder is not None:
+            self.recorder.stop()
+        self.finish_trigger()
         super().closeEvent(ev)
 
 
@@ -631,42 +3387,165 @@ class LeftMenuTree(QTreeWidget):
         self.setColumnCount(1)
         self.update_checkbox()
         self.itemDoubleClicked.connect(self.item_double_click_handle)
+        self.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        self.customContextMenuRequested.connect(self.context_menu_handle)
 
     def update_checkbox(self):
         self.clear()
         self.widgets = []
         self.setHeaderHidden(True)
         self.setFixedWidth(200)
-        for category, column_data in self.main_window.data.categories.items():
-            if not column_data['visible']:
+        sources = self.main_window.sources
+        for source in sources:
+            # при нескольких источниках категории группируются по источнику
+            parent = self
+            if len(sources) > 1:
+                parent = QTreeWidgetItem(self)
+                parent.setText(0, f'{source.name} (порт {source.port})')
+                parent.setExpanded(True)
+
+            for category, column_data in MainData.categories.items():
+                if not column_data['visible']:
+                    continue
+                tree_category = QTreeWidgetItem(parent)
+                tree_category.setText(0, category)
+                tree_category.setExpanded(True)
+
+                count = len(column_data['headers'])
+
+                for index in range(count):
+                    column_widget = QTreeWidgetItem(tree_category)
+                    column_widget.setText(0, column_data['headers'][index])
+                    if 'tooltip' in column_data:
+                        column_widget.setToolTip(0, column_data['tooltip'][index])
+                    column_widget.setData(
+                        0, Qt.UserRole, self.main_window.get_channel_name(
+                            column_data['headers'][index], source))
+                    column_widget.setCheckState(0, Qt.CheckState.Unchecked)
+                    self.widgets.append(column_widget)
+
+            if not source.data.derived:
                 continue
-            tree_category = QTreeWidgetItem(self)
-            tree_category.setText(0, category)
+            tree_category = QTreeWidgetItem(parent)
+            tree_category.setText(0, 'Производные')
             tree_category.setExpanded(True)
-
-            count = len(column_data['headers'])
-
-            for index in range(count):
+            for name, channel in source.data.derived.items():
                 column_widget = QTreeWidgetItem(tree_category)
-                column_widget.setText(0, column_data['headers'][index])
-                if 'tooltip' in column_data:
-                    column_widget.setToolTip(0, column_data['tooltip'][index])
-                # column_widget.setData(0, Qt.UserRole, column_data['headers'][index])
-                # print(column_widget.data(0, Qt.UserRole))
+                column_widget.setText(0, name)
+                column_widget.setToolTip(0, channel.expression if channel.error is None
+                                         else f'{channel.expression}\n{channel.error}')
+                column_widget.setData(
+                    0, Qt.UserRole, self.main_window.get_channel_name(name, source))
+                column_widget.setData(0, Qt.UserRole + 1, name)
                 column_widget.setCheckState(0, Qt.CheckState.Unchecked)
                 self.widgets.append(column_widget)
 
+    def context_menu_handle(self, position):
+        menu = QMenu(self)
+        add_action = menu.addAction('Добавить производный канал')
+        add_action.triggered.connect(self.main_window.add_derived_channel)
+        item = self.itemAt(position)
+        name = item.data(0, Qt.UserRole + 1) if item is not None else None
+        if name is not None:
+            delete_action = menu.addAction('Удалить производный канал')
+            delete_action.triggered.connect(
+                partial(self.main_window.delete_derived_channel, name))
+        menu.exec(self.viewport().mapToGlobal(position))
+
     def item_double_click_handle(self, item: QTreeWidgetItem):
         if not item in self.widgets:
             return
-        self.main_window.create_graph_window((item.text(0),))
+        self.main_window.create_graph_window((item.data(0, Qt.UserRole),))
 
     def get_checked_element(self):
         return [
-            item.text(0) for item in self.widgets if item.checkState(0) == Qt.CheckState.Checked
+            item.data(0, Qt.UserRole) for item in self.widgets
+            if item.checkState(0) == Qt.CheckState.Checked
         ]
 
 
+class ScrollingCurve(pg.ItemGroup):
+    def __init__(self, name, pen, channel=None, chunk_size=1000):
+        super().__init__()
+        self.opts = {'name': name, 'pen': pen}
+        self.channel = channel or name
+        self.time_axis = False
+        self.chunk_size = chunk_size
+        # закрытые куски кривой не перестраиваются, обновляется только последний
+        self.chunks = deque()
+        self.level = None
+        self.source = None
+        self.total = 0
+        self.tail = self.create_curve()
+
+    def name(self):
+        return self.opts['name']
+
+    def create_curve(self):
+        curve = pg.PlotCurveItem(pen=self.opts['pen'], skipFiniteCheck=True)
+        curve.setParentItem(self)
+        return curve
+
+    def remove_curve(self, curve):
+        if curve.scene() is not None:
+            curve.scene().removeItem(curve)
+
+    def clear(self):
+        for *_, curve in self.chunks:
+            self.remove_curve(curve)
+        self.chunks.clear()
+
+    def update_data(self, data, count, level):
+        name = self.channel
+        origin, total = data.get_window(name, count)
+        block = 1 if level is None else level.block
+        start = origin // block
+        stop = total if level is None else level.mins.total
+
+        source = (data, data.generation, self.time_axis)
+        if (level is not self.level or source != self.source
+                or total < self.total
+                or (self.chunks and start < self.chunks[0][0])):
+            self.clear()
+            self.level = level
+            self.source = source
+        self.total = total
+
+        while self.chunks and self.chunks[0][1] <= start:
+            self.remove_curve(self.chunks.popleft()[2])
+
+        position = self.chunks[-1][1] if self.chunks else start
+        while position < stop:
+            if self.chunks and self.chunks[-1][1] - self.chunks[-1][0] < self.chunk_size:
+                chunk_start, _, curve = self.chunks.pop()
+            else:
+                chunk_start, curve = position, self.create_curve()
+            chunk_stop = min(chunk_start + self.chunk_size, stop)
+            curve.setData(*self.get_points(data, level, chunk_start - 1, chunk_stop))
+            self.chunks.append((chunk_start, chunk_stop, curve))
+            position = chunk_stop
+
+        if level is None:
+            self.tail.setData([], [])
+        else:
+            self.tail.setData(*self.get_points(data, None, stop * block, total))
+        self.setPos(0 if self.time_axis else -origin, 0)
+
+    def get_points(self, data, level, start, stop):
+        ox, oy = data.get_points(self.channel, level, start, stop)
+        return (data.get_times(ox) if self.time_axis else ox), oy
+
+    def dataBounds(self, ax, frac=1.0, orthoRange=None):
+        bounds = [
+            curve.dataBounds(ax, frac)
+            for curve in [self.tail, *(chunk[2] for chunk in self.chunks)]
+        ]
+        bounds = [bound for bound in bounds if bound[0] is not None]
+        if not bounds:
+            return None
+        return min(bound[0] for bound in bounds), max(bound[1] for bound in bounds)
+
+
 class GraphWidget(pg.PlotWidget):
     colors = cycle([
         'red', 'green', 'blue', 'cyan',
@@ -680,7 +3559,11 @@ class GraphWidget(pg.PlotWidget):
         self.graph_names = graph_names
         self.main_window = main_window
         self.resolution = 1
-        self.ox_cache = np.arange(self.resolution)
+        self.time_axis = None
+        self.time_source = None
+        self.last_time = None
+        self.updating = False
+        self.rendered_state = None
         self.region = pg.LinearRegionItem()
         self.region.sigRegionChanged.connect(self.update_region)
         self.addItem(self.region)
@@ -690,6 +3573,7 @@ class GraphWidget(pg.PlotWidget):
             self.region.lines[0], '', position=0.55, rotateAxis=(0, 0), anchor=(1, 0))
 
         self.curves = {}
+        self.gap_lines = []
         self.getAxis('left').setWidth(50)
 
         close_action = QAction('Закрыть (Средняя клавиша мышки)')
@@ -714,20 +3598,19 @@ class GraphWidget(pg.PlotWidget):
         self.showGrid(x=True, y=True)
         self.apply_theme('black')
         self.setClipToView(True)
-        self.setDownsampling(auto=True, mode='subsample')
 
         for name in self.graph_names:
             color = next(self.colors)
             pen = pg.mkPen(color=color, width=1)
-            oy = self.main_window.data.get_object(
-                name)[-self.main_window.resolution:]
-            ox = np.arange(len(oy))
-            curve = pg.PlotDataItem(ox, oy, name=name, pen=pen, connect='all')
+            curve = ScrollingCurve(name, pen, self.main_window.get_channel(name)[1])
 
             self.addItem(curve)
+            self.getPlotItem().legend.addItem(curve, name)
             self.curves[name] = curve
 
         self.scene().sigMouseMoved.connect(self.mouse_moved)
+        self.sigXRangeChanged.connect(self.range_changed)
+        self.update_data()
 
     def mouse_moved(self, ev):
         if self.sceneBoundingRect().contains(ev):
@@ -738,9 +3621,11 @@ class GraphWidget(pg.PlotWidget):
                 widget.vLine.show()
             self.hLine.show()
 
-            curr_time = self.main_window.data.get_time(int(mousePoint.x()))
+            data = self.get_data()
+            sample = self.get_sample(mousePoint.x())
+            curr_time = self.get_time(sample, data)
             self.setToolTip(
-                f'Текущий пакет: <b>{int(mousePoint.x())}</b><br>'
+                f'Текущий пакет: <b>{data.get_packet(sample)}</b><br>'
                 + f'Текущее значение: <b>{mousePoint.y():.3f}</b><br>'
                 + f'Текущее время: <b>{curr_time}</b><br>'
             )
@@ -768,13 +3653,49 @@ class GraphWidget(pg.PlotWidget):
 
     def update_region(self):
         minX, maxX = self.region.getRegion()
-        min_time = self.main_window.data.get_time(int(minX))
-        max_time = self.main_window.data.get_time(int(maxX))
-        if not all((min_time, max_time)):
+        min_time = self.get_time(self.get_sample(minX))
+        max_time = self.get_time(self.get_sample(maxX))
+        if min_time is None or max_time is None:
             return
-        self.region_label.setText(
-            f'Временной отрезок: {(max_time - min_time):.4f}'
-        )
+        lines = [f'Временной отрезок: {(max_time - min_time):.4f}']
+        # статистика по выделению берётся из префиксных сумм, без прохода по отсчётам
+        for name, curve in self.curves.items():
+            data = self.main_window.get_channel(name)[0]
+            field, column = data.channels[curve.channel]
+            if field not in data.prefix:
+                continue
+            stats = data.get_stats(
+                field, self.get_sample(minX, data), self.get_sample(maxX, data) + 1)
+            if stats is None:
+                continue
+            if column is not None:
+                stats = {key: value[column] for key, value in stats.items()
+                         if np.ndim(value)}
+            lines.append(
+                f'{name}: ср {stats["mean"]:.3f}, мин {stats["min"]:.3f}, '
+                f'макс {stats["max"]:.3f}, СКО {stats["std"]:.3f}')
+        self.region_label.setText('\n'.join(lines))
+
+    def get_data(self):
+        # подсказки и маркеры берутся из хранилища первого канала графика
+        return self.main_window.get_channel(self.graph_names[0])[0]
+
+    def get_sample(self, x, data=None):
+        if data is None:
+            data = self.get_data()
+        if self.time_axis:
+            return data.find_sample(x)
+        origin, _ = data.get_window('time_src', self.resolution)
+        return origin + int(x)
+
+    def get_time(self, sample, data=None):
+        if data is None:
+            data = self.get_data()
+        time_value = data.get_time(sample)
+        # на оси времени подсказки в тех же секундах, что и подписи оси
+        if time_value is not None and self.time_axis:
+            time_value = time_value * MainData.time_scale
+        return time_value
 
     def apply_theme(self, color):
         self.setBackground(color)
@@ -790,17 +3711,85 @@ class GraphWidget(pg.PlotWidget):
             offset=(0, 0)
         )
 
+    def range_changed(self):
+        if not self.updating and not self.main_window.frozen:
+            self.update_data()
+
+    def update_time_range(self, reset):
+        data = self.get_data()
+        origin, total = data.get_window('time_src', self.resolution)
+        if total <= origin:
+            return
+        first, last = data.get_times([origin, total - 1])
+        min_x, max_x = self.getPlotItem().vb.viewRange()[0]
+        source = (data, data.generation)
+        if reset or self.last_time is None or source != self.time_source:
+            self.time_source = source
+            self.setXRange(first, last, padding=0)
+        elif self.last_time is not None and \
+                max_x >= self.last_time - 0.01 * (max_x - min_x):
+            # вид, прижатый к последнему пакету, едет вслед за ним с прежней шириной
+            self.setXRange(last - (max_x - min_x), last, padding=0)
+        self.last_time = last
+
     def update_data(self):
         resolution_changed = self.resolution != self.main_window.resolution
-        if resolution_changed:
-            self.resolution = self.main_window.resolution
+        mode_changed = self.time_axis != self.main_window.time_axis
+        self.resolution = self.main_window.resolution
+        self.time_axis = self.main_window.time_axis
+        self.updating = True
+        if mode_changed:
+            self.last_time = None
+            self.setLabel('bottom', 'Время, с' if self.time_axis else '')
+            for curve in self.curves.values():
+                curve.time_axis = self.time_axis
+        if self.time_axis:
+            self.update_time_range(resolution_changed or mode_changed)
+        elif resolution_changed or mode_changed:
             self.setXRange(0, self.resolution)
-            self.ox_cache = np.arange(self.resolution)
-
+        self.updating = False
+
+        # уровень пирамиды выбирается так, чтобы на пиксель приходился один min/max блок
+        view_box = self.getPlotItem().vb
+        pixels = max(int(view_box.width()), 100)
+        min_x, max_x = view_box.viewRange()[0]
+        if self.time_axis:
+            span = self.get_sample(max_x) - self.get_sample(min_x)
+        else:
+            span = min(max_x, self.resolution) - max(min_x, 0)
         for name, curve in self.curves.items():
-            data = self.main_window.data.get_object(name)
-            oy = data[-self.resolution:]
-            curve.setData(self.ox_cache[:len(oy)], oy)
+            data = self.main_window.get_channel(name)[0]
+            level = data.get_level(curve.channel, span, pixels)
+            curve.update_data(data, self.resolution, level)
+        self.update_gap_lines()
+        self.rendered_state = self.data_state()
+
+    def update_gap_lines(self, max_lines=200):
+        data = self.get_data()
+        origin, total = data.get_window('time_src', self.resolution)
+        gaps = data.get_gaps(origin, total)[-max_lines:]
+        while len(self.gap_lines) < len(gaps):
+            line = pg.InfiniteLine(
+                angle=90, movable=False,
+                pen=pg.mkPen('yellow', width=1, style=Qt.PenStyle.DashLine))
+            self.addItem(line, ignoreBounds=True)
+            self.gap_lines.append(line)
+        positions = data.get_times(gaps) if self.time_axis else gaps - origin
+        for line, position in zip(self.gap_lines, positions):
+            line.setPos(position)
+            line.show()
+        for line in self.gap_lines[len(gaps):]:
+            line.hide()
+
+    def data_state(self):
+        states = []
+        for name in self.graph_names:
+            data, channel = self.main_window.get_channel(name)
+            states.append((data, data.generation, data.get_window(channel, 1)[1]))
+        return self.main_window.resolution, self.main_window.time_axis, tuple(states)
+
+    def is_changed(self):
+        return self.data_state() != self.rendered_state
 
 
 class VidGraph(pg.PlotWidget):
@@ -808,6 +3797,7 @@ class VidGraph(pg.PlotWidget):
         super().__init__()
         self.main_window = main_window
         self.pos = pos
+        self.rendered_state = None
         self.getAxis('left').setWidth(50)
         self.create_graphs()
 
@@ -823,8 +3813,9 @@ class VidGraph(pg.PlotWidget):
         data = self.main_window.data.get_object(
             'vid_data')
 
+        self.ox = np.arange(MainData.categories['vid_data']['shape'][0])
         oy = data[self.pos] if len(data) else []
-        ox = np.arange(len(oy))
+        ox = self.ox[:len(oy)]
         self.curve = pg.PlotDataItem(ox, oy, name='vid_data',
                                      pen=pen, connect='all')
         self.addItem(self.curve)
@@ -856,8 +3847,15 @@ class VidGraph(pg.PlotWidget):
     def update_data(self):
         data = self.main_window.data.get_object('vid_data')
         oy = data[self.pos] if len(data) else []
-        ox = np.arange(len(oy))
-        self.curve.setData(ox, oy)
+        self.curve.setData(self.ox[:len(oy)], oy)
+        self.rendered_state = self.data_state()
+
+    def data_state(self):
+        data = self.main_window.data
+        return data, data.generation, data.get_window('vid_data', 1)[1]
+
+    def is_changed(self):
+        return self.data_state() != self.rendered_state
 
     def context_menu(self, ev):
         menu = QMenu()
@@ -871,6 +3869,266 @@ class VidGraph(pg.PlotWidget):
         super().closeEvent(ev)
 
 
+class WaterfallGraph(pg.PlotWidget):
+    def __init__(self, main_window, rows=512, decimation=1, tile_rows=64):
+        super().__init__()
+        self.main_window = main_window
+        self.rows = rows
+        self.decimation = max(decimation, 1)
+        self.tile_rows = tile_rows
+        self.frame_size = MainData.categories['vid_data']['shape'][0]
+        self.lut = pg.colormap.get('viridis').getLookupTable(nPts=256)
+        self.rendered_state = None
+        self.getAxis('left').setWidth(50)
+        self.create_graphs()
+
+    def create_graphs(self):
+        self.setBackground('black')
+        self.setMenuEnabled(False)
+        self.scene().sigMouseClicked.connect(self.mouse_click_event)
+        self.getAxis('left').setLabel('кадров назад')
+        self.setXRange(0, self.frame_size, padding=0)
+        self.setYRange(-self.rows * self.decimation, 0, padding=0)
+        # история режется на плитки: новые строки пишутся только в последнюю,
+        # остальные не перерисовываются, а лишь сдвигаются вниз
+        self.tiles = deque()
+        self.free_tiles = []
+        self.source = None
+        self.total = 0
+        self.written = 0
+        self.pending = None
+        self.update_data()
+
+    def reset_tiles(self):
+        while self.tiles:
+            tile = self.tiles.popleft()
+            tile['image'].hide()
+            self.free_tiles.append(tile)
+        self.written = 0
+        self.pending = None
+
+    def create_tile(self, start):
+        if self.free_tiles:
+            tile = self.free_tiles.pop()
+            tile['array'][:] = 0
+        else:
+            image = pg.ImageItem(axisOrder='row-major')
+            image.setLookupTable(self.lut)
+            image.setLevels((0, 255))
+            self.addItem(image)
+            tile = {
+                'image': image,
+                'array': np.zeros((self.tile_rows, self.frame_size), np.uint8)
+            }
+        tile['start'] = start
+        tile['image'].show()
+        self.tiles.append(tile)
+        return tile
+
+    def decimate(self, frames):
+        # строка водопада - максимум по decimation кадрам, чтобы не терять короткие импульсы
+        if self.decimation == 1:
+            return frames
+        if self.pending is not None:
+            frames = np.concatenate((self.pending, frames))
+        complete = len(frames) // self.decimation * self.decimation
+        self.pending = frames[complete:].copy() if complete < len(frames) else None
+        return frames[:complete].reshape(
+            -1, self.decimation, self.frame_size).max(axis=1)
+
+    def write_rows(self, rows):
+        changed = set()
+        position = 0
+        while position < len(rows):
+            tile = self.tiles[-1] if self.tiles else None
+            if tile is None or self.written - tile['start'] >= self.tile_rows:
+                tile = self.create_tile(self.written)
+            offset = self.written - tile['start']
+            count = min(self.tile_rows - offset, len(rows) - position)
+            tile['array'][offset:offset + count] = rows[position:position + count]
+            changed.add(id(tile))
+            position += count
+            self.written += count
+
+        while self.tiles and self.tiles[0]['start'] + self.tile_rows <= \
+                self.written - self.rows:
+            tile = self.tiles.popleft()
+            tile['image'].hide()
+            self.free_tiles.append(tile)
+        return changed
+
+    def update_data(self):
+        data = self.main_window.data
+        buffer = data.buffers['vid_data']
+        source = (data, data.generation)
+        if source != self.source or buffer.total < self.total:
+            self.reset_tiles()
+            self.source = source
+            self.total = buffer.total - len(buffer)
+
+        # берутся только кадры, пришедшие после прошлой отрисовки
+        start = max(self.total, buffer.total - self.rows * self.decimation)
+        frames = buffer.get_range(start, buffer.total)
+        self.total = buffer.total
+        changed = self.write_rows(self.decimate(frames)[-self.rows:])
+
+        for tile in self.tiles:
+            if id(tile) in changed:
+                tile['image'].setImage(tile['array'], autoLevels=False)
+            top = (tile['start'] - self.written) * self.decimation
+            tile['image'].setRect(QRectF(
+                0, top, self.frame_size, self.tile_rows * self.decimation))
+        self.rendered_state = self.data_state()
+
+    def data_state(self):
+        data = self.main_window.data
+        return data, data.generation, data.get_window('vid_data', 1)[1]
+
+    def is_changed(self):
+        return self.data_state() != self.rendered_state
+
+    def mouse_click_event(self, ev):
+        if ev.button() == Qt.MouseButton.RightButton:
+            menu = QMenu()
+            close_action = QAction('Закрыть (Средняя клавиша мышки)')
+            close_action.triggered.connect(self.close)
+            menu.addAction(close_action)
+            menu.exec(ev.screenPos().toPoint())
+            ev.accept()
+
+    def mousePressEvent(self, ev):
+        if ev.button() == Qt.MouseButton.MiddleButton:
+            self.close()
+        return super().mousePressEvent(ev)
+
+    def closeEvent(self, ev):
+        self.main_window.graph_waterfall_widget = None
+        super().closeEvent(ev)
+
+
+class LogicGraph(pg.PlotWidget):
+    colors = ['red', 'green', 'cyan', 'yellow', 'fuchsia', 'orange', 'lime',
+              'white', 'aqua']
+
+    def __init__(self, main_window, height=0.7):
+        super().__init__()
+        self.main_window = main_window
+        self.height = height
+        self.rendered_state = None
+        self.groups = [
+            np.array([MainData.channels[name][1] for name in group])
+            for group in MainData.columns_bits
+        ]
+        self.getAxis('left').setWidth(110)
+        self.create_graphs()
+
+    def create_graphs(self):
+        self.setBackground('black')
+        self.setMenuEnabled(False)
+        self.scene().sigMouseClicked.connect(self.mouse_click_event)
+        # каналы идут сверху вниз в порядке групп columns_bits
+        count = sum(len(group) for group in self.groups)
+        self.bases = []
+        ticks = []
+        row = 0
+        for group, names in zip(self.groups, MainData.columns_bits):
+            bases = count - 1 - np.arange(row, row + len(group), dtype=np.float64)
+            self.bases.append(bases)
+            ticks.extend(zip(bases + self.height / 2, names))
+            row += len(group)
+        self.getAxis('left').setTicks([ticks])
+        self.setYRange(-0.5, count, padding=0)
+        self.enableAutoRange(y=False)
+        self.curves = []
+        for index in range(len(self.groups)):
+            curve = pg.PlotCurveItem(
+                pen=pg.mkPen(self.colors[index % len(self.colors)], width=1),
+                connect='finite', skipFiniteCheck=True)
+            self.addItem(curve)
+            self.curves.append(curve)
+        self.update_data()
+
+    def build_trace(self, group, bases, state, start, stop, samples, columns, values):
+        # на канал: начальная точка, по две точки на фронт, конечная точка и разрыв
+        rows = np.full(len(state), -1)
+        rows[group] = np.arange(len(group))
+        selected = rows[columns] >= 0
+        samples, row, values = samples[selected], rows[columns[selected]], values[selected]
+        order = np.lexsort((samples, row))
+        samples, row, values = samples[order], row[order], values[order]
+
+        counts = np.bincount(row, minlength=len(group))
+        first_edge = np.cumsum(counts) - counts
+        row_start = np.cumsum(counts * 2 + 3) - (counts * 2 + 3)
+        initial = state[group].astype(np.float64)
+        previous = np.empty(len(values))
+        previous[1:] = values[:-1]
+        previous[first_edge[counts > 0]] = initial[counts > 0]
+        final = initial.copy()
+        final[counts > 0] = values[first_edge[counts > 0] + counts[counts > 0] - 1]
+
+        x = np.empty(row_start[-1] + counts[-1] * 2 + 3)
+        y = np.empty(len(x))
+        x[row_start] = start
+        y[row_start] = bases + initial * self.height
+        position = row_start[row] + 1 + 2 * (np.arange(len(samples)) - first_edge[row])
+        x[position] = x[position + 1] = samples
+        y[position] = bases[row] + previous * self.height
+        y[position + 1] = bases[row] + values * self.height
+        end = row_start + 1 + 2 * counts
+        x[end] = stop
+        y[end] = bases + final * self.height
+        x[end + 1] = y[end + 1] = np.nan
+        return x, y
+
+    def update_data(self):
+        data = self.main_window.data
+        origin, total = data.get_window('time_src', self.main_window.resolution)
+        result = data.get_transitions(origin, total)
+        if result is None:
+            for curve in self.curves:
+                curve.setData([], [])
+            self.rendered_state = self.data_state()
+            return
+        start, stop, state, samples, columns, values = result
+        for curve, group, bases in zip(self.curves, self.groups, self.bases):
+            x, y = self.build_trace(
+                group, bases, state, start, stop - 1, samples, columns, values)
+            finite = ~np.isnan(x)
+            if self.main_window.time_axis:
+                x[finite] = data.get_times(x[finite])
+            else:
+                x[finite] -= origin
+            curve.setData(x, y)
+        self.rendered_state = self.data_state()
+
+    def data_state(self):
+        data = self.main_window.data
+        return (self.main_window.resolution, self.main_window.time_axis, data,
+                data.generation, data.get_window('time_src', 1)[1])
+
+    def is_changed(self):
+        return self.data_state() != self.rendered_state
+
+    def mouse_click_event(self, ev):
+        if ev.button() == Qt.MouseButton.RightButton:
+            menu = QMenu()
+            close_action = QAction('Закрыть (Средняя клавиша мышки)')
+            close_action.triggered.connect(self.close)
+            menu.addAction(close_action)
+            menu.exec(ev.screenPos().toPoint())
+            ev.accept()
+
+    def mousePressEvent(self, ev):
+        if ev.button() == Qt.MouseButton.MiddleButton:
+            self.close()
+        return super().mousePressEvent(ev)
+
+    def closeEvent(self, ev):
+        self.main_window.graph_logic_widget = None
+        super().closeEvent(ev)
+
+
 def launch():
     app = QApplication(sys.argv)
 
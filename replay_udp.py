@@ -0,0 +1,57 @@
+import argparse
+import socket
+import time
+
+from main import MainData, RecordIndex, RecordReader
+
+
+def replay(file_name, host, port, speed, loop):
+    index = RecordIndex(RecordReader(file_name).frames)
+    frames = index.frames
+    packet_size = frames.dtype.itemsize
+    data = memoryview(frames.view('u1').reshape(-1))
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sent = 0
+    started = time.perf_counter()
+    while True:
+        position = 0
+        wall_start = time.perf_counter()
+        source_start = index.get_time(0)
+        while position < len(frames):
+            # отправляются все пакеты, чьё время time_src уже наступило
+            if speed > 0:
+                elapsed = (time.perf_counter() - wall_start) * speed
+                due = max(index.find(
+                    source_start + elapsed / MainData.time_scale), position)
+            else:
+                due = len(frames)
+            for packet in range(position, due):
+                sock.sendto(data[packet * packet_size:(packet + 1) * packet_size],
+                            (host, port))
+            sent += due - position
+            if due == position:
+                delay = (index.get_time(position) - source_start) \
+                    * MainData.time_scale / speed \
+                    - (time.perf_counter() - wall_start)
+                time.sleep(min(max(delay, 0.0005), 0.05))
+            position = due
+        if not loop:
+            break
+
+    elapsed = time.perf_counter() - started
+    print(f'Отправлено пакетов: {sent} за {elapsed:.2f} с '
+          f'({sent / max(elapsed, 1e-9):.0f} пакетов/с)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Воспроизведение файла записи (*.vgr) по UDP')
+    parser.add_argument('file_name')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=2015)
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='множитель скорости, 0 - максимальная скорость')
+    parser.add_argument('--loop', action='store_true')
+    args = parser.parse_args()
+    replay(args.file_name, args.host, args.port, args.speed, args.loop)
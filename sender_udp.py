@@ -1,9 +1,11 @@
+import argparse
+import multiprocessing
 import socket
 import time
-import random
-import struct
+
 import numpy as np
-from datetime import datetime, timedelta
+
+from main import MainData
 
 data = b"\xff\xff\xff\xff\xff\xff\x00\x55\x22\xb0\x9d\x39\x08\x00\x45\x00" \
 b"\x04\xec\x24\x4c\x00\x00\x80\x11\x8e\xb6\xc0\xa8\x01\x0a\xc0\xa8" \
@@ -86,29 +88,176 @@ b"\x00\xff\xf1\xab\xcd\x00\x2d\x96\x21\x00\x00\x00\x00\x00\x00\x00" \
 b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00" \
 b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00"
 
-print(len(data) - 42)
-
 
 UDP_IP = "localhost"  # адрес назначения для broadcast
 UDP_PORT = 2015  # порт, на который отправляется сообщение
+TIME_TICK = 20e-6  # цена младшего разряда time_src, с
+
+
+def generate_frames(count, rate, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = np.empty(count, dtype=MainData.dt)
+    frames[:] = np.frombuffer(data[42:], dtype=MainData.dt)[0]
+    index = np.arange(count)
+    t = index / rate
+
+    # синусоиды разной частоты и амплитуды с шумом в каждом канале data_main
+    freqs = rng.uniform(0.1, 20, 42)
+    amps = rng.uniform(500, 12000, 42)
+    phases = rng.uniform(0, 2 * np.pi, 42)
+    values = amps * np.sin(2 * np.pi * freqs * t[:, None] + phases)
+    values += rng.normal(0, 50, values.shape)
+    main_types = MainData.categories['main']['types']
+    unsigned = [i for i, type in enumerate(main_types) if np.dtype(type).kind == 'u']
+    values[:, unsigned] = np.abs(values[:, unsigned]) * 2
+    frames['data_main'] = np.clip(values, -32768, 65535).astype(
+        np.int64).astype(np.uint16).view(np.int16)
+
+    # каждый флаг переключается со своим периодом
+    periods = rng.integers(10, 5000, 72)
+    bits = ((index[:, None] // periods) % 2).astype(np.uint8)
+    frames['bit_data'] = np.packbits(bits, axis=1, bitorder='little')
+
+    frames['arinc_data'] = (index[:, None] // 100 + np.arange(9)) & 0xFFFF
+
+    # видеосигнал: шум и импульс, положение которого меняется со временем
+    positions = np.arange(1024)
+    bank = rng.normal(20, 5, (256, 1024))
+    centers = 512 + 400 * np.sin(np.linspace(0, 2 * np.pi, 256, endpoint=False))
+    bank += 200 * np.exp(-((positions - centers[:, None]) / 8) ** 2)
+    bank = np.clip(bank, 0, 255).astype(np.uint8)
+    frames['vid_data'] = bank[(index * 256 // max(count, 1)) % 256]
+    return frames
+
+
+def make_order(count, drop, reorder, rng):
+    order = np.arange(count)
+    chosen = rng.random(count - 1) < reorder
+    # пары не должны пересекаться, иначе соседние обмены теряют и дублируют пакеты
+    chosen[1:] &= ~chosen[:-1]
+    swaps = np.flatnonzero(chosen)
+    order[swaps], order[swaps + 1] = order[swaps + 1], order[swaps].copy()
+    # пропущенные пакеты остаются в очереди пустыми слотами, чтобы не сбивать ритм
+    order[rng.random(count) < drop] = -1
+    return order
+
+
+def send(args, sender=0):
+    frames = generate_frames(args.frames, args.rate, args.seed + sender)
+    packet_size = MainData.dt.itemsize
+    ticks = np.arange(len(frames)) / (args.rate * TIME_TICK)
+    rng = np.random.default_rng(args.seed + sender)
+    address = (args.host, args.port + sender * args.port_step)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 8 * 1024 * 1024)
+
+    started = time.perf_counter()
+    sent = 0
+    dropped = 0
+    cycle = 0
+    last_report = started
+    while args.count is None or sent + dropped < args.count:
+        # кадры генерируются один раз, в каждом цикле сдвигается только time_src
+        base = args.time_start + cycle * len(frames) / (args.rate * TIME_TICK)
+        frames['time_src'][:, 0] = (base + ticks).astype(np.uint32)
+        order = make_order(len(frames), args.drop, args.reorder, rng)
+        payload = memoryview(frames.view(np.uint8).reshape(-1))
+        if args.count is not None:
+            order = order[:args.count - sent - dropped]
+        position = 0
+        while position < len(order):
+            now = time.perf_counter()
+            elapsed = now - started
+            if args.duration is not None and elapsed >= args.duration:
+                return report(sender, sent, dropped, elapsed)
+            active = elapsed
+            if args.off:
+                # в паузах цикла вкл/выкл пакеты не догоняются, остаётся разрыв
+                period = args.on + args.off
+                if elapsed % period >= args.on:
+                    time.sleep(min(period - elapsed % period, 0.01))
+                    continue
+                active = elapsed // period * args.on + elapsed % period
+
+            # ритм держится по часам, а не по sleep после каждого пакета
+            due = min(int(active * args.rate) - sent - dropped, len(order) - position)
+            if due < min(args.burst, len(order) - position):
+                time.sleep(0 if args.rate > 10_000 else 0.0005)
+                continue
+            for packet in order[position:position + due]:
+                if packet < 0:
+                    dropped += 1
+                    continue
+                sock.sendto(payload[packet * packet_size:(packet + 1) * packet_size],
+                            address)
+                sent += 1
+            position += due
+            if now - last_report >= 1:
+                report(sender, sent, dropped, elapsed)
+                last_report = now
+        cycle += 1
+    report(sender, sent, dropped, time.perf_counter() - started)
+
 
-# Создаем UDP-сокет
-sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+def send_random(args):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    while True:
+        sock.sendto(np.random.randint(0, 256, size=1232, dtype=np.uint8).tobytes(),
+                    (args.host, args.port))
+        time.sleep(1 / args.rate)
 
-# Устанавливаем опцию сокета для разрешения broadcast
-sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
 
+def report(sender, sent, dropped, elapsed):
+    print(f'[{sender}] отправлено: {sent}, пропущено: {dropped}, '
+          f'скорость: {sent / max(elapsed, 1e-9):.0f} пакетов/с')
 
-# for i in range(1000):
-while True:
-    # x = random.randint(0, 100)
-    # y = random.randint(0, 100)
-    # z = random.randint(0, 100)
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Генератор UDP-пакетов')
+    parser.add_argument('--host', default=UDP_IP)
+    parser.add_argument('--port', type=int, default=UDP_PORT)
+    parser.add_argument('--rate', type=float, default=1000,
+                        help='пакетов в секунду на одного отправителя')
+    parser.add_argument('--burst', type=int, default=1,
+                        help='пакетов, отправляемых подряд без пауз')
+    parser.add_argument('--on', type=float, default=1.0,
+                        help='длительность передачи в цикле вкл/выкл, с')
+    parser.add_argument('--off', type=float, default=0.0,
+                        help='длительность паузы в цикле вкл/выкл, с')
+    parser.add_argument('--drop', type=float, default=0.0,
+                        help='доля намеренно пропускаемых пакетов')
+    parser.add_argument('--reorder', type=float, default=0.0,
+                        help='доля пакетов, переставляемых с соседним')
+    parser.add_argument('--senders', type=int, default=1)
+    parser.add_argument('--port-step', type=int, default=0,
+                        help='шаг порта для каждого следующего отправителя')
+    parser.add_argument('--frames', type=int, default=65_536,
+                        help='размер заранее сгенерированного набора кадров')
+    parser.add_argument('--count', type=int, default=None)
+    parser.add_argument('--duration', type=float, default=None)
+    parser.add_argument('--time-start', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--random', action='store_true',
+                        help='отправлять случайные байты, как раньше')
+    args = parser.parse_args()
+    # time_src идёт тиками по TIME_TICK: чаще одного пакета на тик метки совпадут
+    if not args.random and not 0 < args.rate <= round(1 / TIME_TICK):
+        parser.error(f'--rate должен быть в пределах (0, {round(1 / TIME_TICK)}] '
+                     f'пакетов/с: time_src считается в тиках по {TIME_TICK * 1e6:.0f} мкс')
 
-    sock.sendto(np.random.randint(0, 256, size=1232, dtype=np.uint8).tobytes(), (UDP_IP, UDP_PORT))
-    # sock.sendto(data[42:], (UDP_IP, UDP_PORT))
-    # print('сообщение отправлено', struct.unpack('>' + 'BBI' + 'B' * 31, packet))
-    # print('сообщение отправлено', packet)
-    # print('отправлено')
-    time.sleep(0.001)
+    if args.random:
+        send_random(args)
+    elif args.senders == 1:
+        send(args)
+    else:
+        processes = [
+            multiprocessing.Process(target=send, args=(args, sender))
+            for sender in range(args.senders)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()